@@ -0,0 +1,69 @@
+"""Add indicator rollups
+
+Revision ID: 266e7e23f1c1
+Revises: 6134659d65d6
+Create Date: 2026-10-17 10:12:04.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '266e7e23f1c1'
+down_revision: Union[str, None] = '6134659d65d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'indicator_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('enterprise_id', sa.Integer(), nullable=False),
+        sa.Column('indicator_id', sa.Integer(), nullable=False),
+        sa.Column('period_type', sa.String(), nullable=False),
+        sa.Column('period_start', sa.Date(), nullable=False),
+        sa.Column('currency_code', sa.String(), nullable=False),
+        sa.Column('total_value', sa.Numeric(), nullable=True),
+        sa.Column('value_count', sa.Integer(), nullable=False),
+        sa.Column('missing_rate_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['enterprise_id'], ['enterprises.id'], ),
+        sa.ForeignKeyConstraint(['indicator_id'], ['indicators.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('enterprise_id', 'indicator_id', 'period_type', 'period_start', 'currency_code', name='uix_indicator_rollup')
+    )
+    op.create_index('ix_rollup_enterprise_period', 'indicator_rollups', ['enterprise_id', 'period_type', 'currency_code', 'period_start'], unique=False)
+
+    # Первичное заполнение свёртки по уже накопленным значениям
+    for period_type in ('month', 'quarter'):
+        op.execute(f"""
+            INSERT INTO indicator_rollups (
+                enterprise_id, indicator_id, period_type, period_start, currency_code,
+                total_value, value_count, missing_rate_count
+            )
+            SELECT iv.enterprise_id, iv.indicator_id, '{period_type}',
+                   CAST(date_trunc('{period_type}', iv.value_date) AS DATE), c.code,
+                   SUM(CASE WHEN iv.currency_code = c.code THEN iv.value ELSE iv.value * er.rate END),
+                   COUNT(iv.id),
+                   SUM(CASE WHEN iv.currency_code != c.code AND er.rate IS NULL THEN 1 ELSE 0 END)
+            FROM indicator_values iv
+            CROSS JOIN currencies c
+            LEFT OUTER JOIN exchange_rates er
+                ON er.from_currency = iv.currency_code
+               AND er.to_currency = c.code
+               AND er.rate_date = iv.value_date
+            WHERE iv.enterprise_id IS NOT NULL
+              AND iv.indicator_id IS NOT NULL
+              AND iv.value_date IS NOT NULL
+            GROUP BY iv.enterprise_id, iv.indicator_id, CAST(date_trunc('{period_type}', iv.value_date) AS DATE), c.code
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_rollup_enterprise_period', table_name='indicator_rollups')
+    op.drop_table('indicator_rollups')
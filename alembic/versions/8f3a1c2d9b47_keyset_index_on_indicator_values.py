@@ -0,0 +1,31 @@
+"""Keyset index on indicator_values
+
+Revision ID: 8f3a1c2d9b47
+Revises: 266e7e23f1c1
+Create Date: 2026-10-17 11:02:51.430127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3a1c2d9b47'
+down_revision: Union[str, None] = '266e7e23f1c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # (value_date, id) покрывает и фильтры по дате, поэтому ix_value_date больше не нужен
+    op.create_index('ix_value_date_id', 'indicator_values', ['value_date', 'id'], unique=False)
+    op.drop_index('ix_value_date', table_name='indicator_values')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_value_date', 'indicator_values', ['value_date'], unique=False)
+    op.drop_index('ix_value_date_id', table_name='indicator_values')
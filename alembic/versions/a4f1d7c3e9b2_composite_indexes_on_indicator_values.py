@@ -0,0 +1,86 @@
+"""Composite covering index and unique constraint on indicator values
+
+Revision ID: a4f1d7c3e9b2
+Revises: e7a2b9c4d1f0
+Create Date: 2026-10-17 17:40:52.118304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4f1d7c3e9b2'
+down_revision: Union[str, None] = 'e7a2b9c4d1f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубликаты по правилу create_indicator_value (все пять полей), оставляем самую раннюю строку
+    deleted = op.get_bind().execute(sa.text("""
+        DELETE FROM indicator_values iv
+        USING indicator_values dup
+        WHERE iv.enterprise_id = dup.enterprise_id
+          AND iv.indicator_id = dup.indicator_id
+          AND iv.value_date = dup.value_date
+          AND iv.value = dup.value
+          AND iv.currency_code = dup.currency_code
+          AND iv.id > dup.id
+    """)).rowcount
+    if deleted:
+        # Суммы в свёртке включали удалённые строки — пересчитываем её целиком
+        op.execute("DELETE FROM indicator_rollups")
+        for period_type in ('month', 'quarter'):
+            op.execute(f"""
+                INSERT INTO indicator_rollups (
+                    enterprise_id, indicator_id, period_type, period_start, currency_code,
+                    total_value, value_count, missing_rate_count
+                )
+                SELECT iv.enterprise_id, iv.indicator_id, '{period_type}',
+                       CAST(date_trunc('{period_type}', iv.value_date) AS DATE), c.code,
+                       SUM(CASE WHEN iv.currency_code = c.code THEN iv.value ELSE iv.value * er.rate END),
+                       COUNT(iv.id),
+                       SUM(CASE WHEN iv.currency_code != c.code AND er.rate IS NULL THEN 1 ELSE 0 END)
+                FROM indicator_values iv
+                CROSS JOIN currencies c
+                LEFT OUTER JOIN exchange_rates er
+                    ON er.from_currency = iv.currency_code
+                   AND er.to_currency = c.code
+                   AND er.rate_date = iv.value_date
+                WHERE iv.enterprise_id IS NOT NULL
+                  AND iv.indicator_id IS NOT NULL
+                  AND iv.value_date IS NOT NULL
+                GROUP BY iv.enterprise_id, iv.indicator_id, CAST(date_trunc('{period_type}', iv.value_date) AS DATE), c.code
+            """)
+
+    # Индексы строятся без блокировки записи. Если CONCURRENTLY прервётся (например, между
+    # чисткой и построением успели записать дубликат), остаётся INVALID-индекс — его удаляем
+    # в начале, поэтому миграцию можно просто запустить повторно.
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_indicator_values_ent_ind_date")
+        op.execute("""
+            CREATE INDEX CONCURRENTLY ix_indicator_values_ent_ind_date
+            ON indicator_values (enterprise_id, indicator_id, value_date)
+            INCLUDE (value, currency_code, id)
+        """)
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uix_indicator_value")
+        op.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY uix_indicator_value
+            ON indicator_values (enterprise_id, indicator_id, value_date, value, currency_code)
+        """)
+        op.execute("ALTER TABLE indicator_values ADD CONSTRAINT uix_indicator_value UNIQUE USING INDEX uix_indicator_value")
+        # Покрывается составным индексом с enterprise_id в начале
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_enterprise_id")
+        op.execute("ANALYZE indicator_values")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_enterprise_id ON indicator_values (enterprise_id)")
+        op.execute("ALTER TABLE indicator_values DROP CONSTRAINT IF EXISTS uix_indicator_value")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_indicator_values_ent_ind_date")
@@ -0,0 +1,109 @@
+"""Partition indicator values by year
+
+Revision ID: c3e8f1a6b5d2
+Revises: a4f1d7c3e9b2
+Create Date: 2026-10-17 18:25:13.402917
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e8f1a6b5d2'
+down_revision: Union[str, None] = 'a4f1d7c3e9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции создаются на год вперёд, дальше их досоздаёт partitions.ensure_future_partitions
+YEARS_AHEAD = 1
+
+
+def _create_indexes(primary_key: str) -> None:
+    op.execute(f"ALTER TABLE indicator_values ADD CONSTRAINT indicator_values_pkey PRIMARY KEY ({primary_key})")
+    op.execute("""
+        ALTER TABLE indicator_values ADD CONSTRAINT uix_indicator_value
+        UNIQUE (enterprise_id, indicator_id, value_date, value, currency_code)
+    """)
+    op.execute("CREATE INDEX ix_value_date_id ON indicator_values (value_date, id)")
+    op.execute("""
+        CREATE INDEX ix_indicator_values_ent_ind_date
+        ON indicator_values (enterprise_id, indicator_id, value_date)
+        INCLUDE (value, currency_code, id)
+    """)
+    op.execute("CREATE INDEX ix_indicator_id ON indicator_values (indicator_id)")
+    op.execute("ANALYZE indicator_values")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    # Ключ секционирования входит в первичный ключ и не может быть NULL
+    missing = bind.execute(sa.text("SELECT COUNT(*) FROM indicator_values WHERE value_date IS NULL")).scalar()
+    if missing:
+        raise RuntimeError(f"indicator_values: {missing} строк без value_date, заполните или удалите их перед миграцией")
+
+    # Таблица переписывается целиком под ACCESS EXCLUSIVE: запускать в окно обслуживания
+    op.execute("LOCK TABLE indicator_values IN ACCESS EXCLUSIVE MODE")
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('indicator_values', 'id')")).scalar()
+    first_year = bind.execute(sa.text("SELECT EXTRACT(YEAR FROM MIN(value_date))::int FROM indicator_values")).scalar()
+    current_year = date.today().year
+    first_year = min(first_year or current_year, current_year)
+
+    op.execute(f"""
+        CREATE TABLE indicator_values_partitioned (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            enterprise_id integer REFERENCES enterprises (id),
+            indicator_id integer REFERENCES indicators (id),
+            value_date date NOT NULL,
+            value numeric,
+            currency_code varchar REFERENCES currencies (code)
+        ) PARTITION BY RANGE (value_date)
+    """)
+    for year in range(first_year, current_year + YEARS_AHEAD + 1):
+        op.execute(f"""
+            CREATE TABLE indicator_values_y{year} PARTITION OF indicator_values_partitioned
+            FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+        """)
+    # Даты дальше созданных секций не ломают вставку, а ждут здесь своей секции
+    op.execute("CREATE TABLE indicator_values_default PARTITION OF indicator_values_partitioned DEFAULT")
+
+    op.execute("""
+        INSERT INTO indicator_values_partitioned (id, enterprise_id, indicator_id, value_date, value, currency_code)
+        SELECT id, enterprise_id, indicator_id, value_date, value, currency_code FROM indicator_values
+    """)
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY indicator_values_partitioned.id")
+    op.execute("DROP TABLE indicator_values")
+    op.execute("ALTER TABLE indicator_values_partitioned RENAME TO indicator_values")
+    # Индексы на родителе создаются в каждой секции; uix_indicator_value включает value_date,
+    # поэтому ON CONFLICT ON CONSTRAINT в create_indicator_value работает и на секциях
+    _create_indexes("id, value_date")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    op.execute("LOCK TABLE indicator_values IN ACCESS EXCLUSIVE MODE")
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('indicator_values', 'id')")).scalar()
+    op.execute(f"""
+        CREATE TABLE indicator_values_plain (
+            id integer NOT NULL DEFAULT nextval('{sequence}'),
+            enterprise_id integer REFERENCES enterprises (id),
+            indicator_id integer REFERENCES indicators (id),
+            value_date date,
+            value numeric,
+            currency_code varchar REFERENCES currencies (code)
+        )
+    """)
+    # Отключённые секции (partitions.detach_year_partition) сюда не попадают
+    op.execute("""
+        INSERT INTO indicator_values_plain (id, enterprise_id, indicator_id, value_date, value, currency_code)
+        SELECT id, enterprise_id, indicator_id, value_date, value, currency_code FROM indicator_values
+    """)
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY indicator_values_plain.id")
+    op.execute("DROP TABLE indicator_values")
+    op.execute("ALTER TABLE indicator_values_plain RENAME TO indicator_values")
+    _create_indexes("id")
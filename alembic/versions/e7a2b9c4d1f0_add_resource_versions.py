@@ -0,0 +1,37 @@
+"""Add resource versions
+
+Revision ID: e7a2b9c4d1f0
+Revises: d9c4e6a1f2b3
+Create Date: 2026-10-17 16:02:11.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a2b9c4d1f0'
+down_revision: Union[str, None] = 'd9c4e6a1f2b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    resource_versions = op.create_table(
+        'resource_versions',
+        sa.Column('resource', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('resource')
+    )
+    op.bulk_insert(resource_versions, [
+        {'resource': resource, 'version': 0}
+        for resource in ('enterprises', 'indicators', 'currencies', 'exchange_rates')
+    ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('resource_versions')
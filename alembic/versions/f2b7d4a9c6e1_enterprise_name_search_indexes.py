@@ -0,0 +1,52 @@
+"""Enterprise name search indexes
+
+Revision ID: f2b7d4a9c6e1
+Revises: c3e8f1a6b5d2
+Create Date: 2026-10-17 19:02:47.630158
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b7d4a9c6e1'
+down_revision: Union[str, None] = 'c3e8f1a6b5d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        # Точное совпадение для фильтра enterprise_name
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_enterprises_name ON enterprises (name)")
+        # Поиск по префиксу в /enterprises/search: lower(name) LIKE 'q%'
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_enterprises_name_prefix
+            ON enterprises (lower(name) text_pattern_ops)
+        """)
+
+        # Без прав на CREATE EXTENSION миграция не падает: приложение увидит, что pg_trgm
+        # нет, и будет искать по индексу в памяти (enterprise_search.EnterpriseIndex)
+        try:
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except sa.exc.DBAPIError as e:
+            print(f"[Migration] pg_trgm недоступен, нечёткий поиск будет идти в памяти: {e.orig}")
+            return
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_enterprises_name_trgm
+            ON enterprises USING gin (lower(name) gin_trgm_ops)
+        """)
+        op.execute("ANALYZE enterprises")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Расширение pg_trgm не удаляется: его могут использовать другие объекты базы
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_enterprises_name_trgm")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_enterprises_name_prefix")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_enterprises_name")
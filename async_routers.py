@@ -0,0 +1,163 @@
+"""Асинхронные версии маршрутов чтения для DB_MODE=async.
+
+Подключаются в main.py раньше основного router, поэтому перехватывают те же пути.
+Запросы собираются теми же построителями из queries.py, что и в routers.py.
+"""
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import schemas
+from dependencies import get_async_db, get_current_async_principal
+from enterprise_search import search_enterprises
+from etags import check_etag, version_stmt
+from pagination import next_cursor_headers
+from queries import (
+    indicator_value_filters, indicator_values_stmt, indicator_value_rows_stmt, needs_conversion,
+    paginate_indicator_values, enterprises_stmt, indicators_stmt,
+    weighted_filters, weighted_totals_stmt, weighted_rows_stmt
+)
+from rate_cache import rate_table
+from rollups import covers_range, grouped_totals_stmt, label_grouped_totals
+from serializers import (
+    serialize_indicator_values, serialize_indicator_value_rows, parse_fields, objects_by_id,
+    weighted_groups, weighted_aggregate, weighted_rows
+)
+
+router = APIRouter()
+
+
+async def _list_reference(request: Request, response: Response, db: AsyncSession, resource: str, model):
+    version = (await db.execute(version_stmt(resource))).scalar() or 0
+    cached = check_etag(request, response, resource, version)
+    if cached:
+        return cached
+    return (await db.execute(select(model))).scalars().all()
+
+
+@router.get("/enterprises/", response_model=List[schemas.EnterpriseSchema], tags=["enterprises"])
+async def get_enterprises(request: Request, response: Response, db: AsyncSession = Depends(get_async_db), principal=Depends(get_current_async_principal)):
+    return await _list_reference(request, response, db, "enterprises", models.Enterprise)
+
+@router.get("/enterprises/search", response_model=List[schemas.EnterpriseSchema], tags=["enterprises"])
+async def search_enterprises_by_name(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    principal=Depends(get_current_async_principal)
+):
+    version = (await db.execute(version_stmt("enterprises"))).scalar() or 0
+    cached = check_etag(request, response, "enterprises", version)
+    if cached:
+        return cached
+    return await db.run_sync(lambda session: search_enterprises(session, q.strip(), skip, limit, version))
+
+@router.get("/indicators/", response_model=List[schemas.IndicatorSchema], tags=["indicators"])
+async def get_indicators(request: Request, response: Response, db: AsyncSession = Depends(get_async_db), principal=Depends(get_current_async_principal)):
+    return await _list_reference(request, response, db, "indicators", models.Indicator)
+
+@router.get("/currencies/", response_model=List[schemas.CurrencySchema], tags=["currencies"])
+async def get_currencies(request: Request, response: Response, db: AsyncSession = Depends(get_async_db), principal=Depends(get_current_async_principal)):
+    return await _list_reference(request, response, db, "currencies", models.Currency)
+
+@router.get("/exchange-rates/", response_model=List[schemas.ExchangeRateSchema], tags=["exchange_rates"])
+async def get_exchange_rates(request: Request, response: Response, db: AsyncSession = Depends(get_async_db), principal=Depends(get_current_async_principal)):
+    return await _list_reference(request, response, db, "exchange_rates", models.ExchangeRate)
+
+
+@router.get("/indicator-values/", response_model=List[schemas.IndicatorValueWithObjects], tags=["indicator_values"])
+async def get_indicator_values(
+    enterprise_id: int = Query(None),
+    indicator_id: int = Query(None),
+    from_date: date = Query(None),
+    to_date: date = Query(None),
+    target_currency: str = Query("RUB"),
+    currency_code: str = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    enterprise_name: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    shape: str = Query("nested", pattern="^(nested|flat)$"),
+    db: AsyncSession = Depends(get_async_db),
+    principal=Depends(get_current_async_principal)
+):
+    if cursor and skip:
+        raise HTTPException(status_code=400, detail="skip cannot be combined with cursor")
+    selected_fields = parse_fields(fields, shape)
+    filters = indicator_value_filters(
+        enterprise_id, indicator_id, from_date, to_date, currency_code, enterprise_name
+    )
+
+    if shape == "nested" and fields is None:
+        stmt = paginate_indicator_values(indicator_values_stmt(filters), cursor, skip, limit)
+        indicator_values = (await db.execute(stmt)).scalars().all()
+        await db.run_sync(rate_table.ensure_loaded)
+        content = serialize_indicator_values(indicator_values, target_currency)
+    else:
+        stmt = paginate_indicator_values(indicator_value_rows_stmt(filters, selected_fields), cursor, skip, limit)
+        indicator_values = (await db.execute(stmt)).all()
+        enterprises = indicators = None
+        if "enterprise" in selected_fields:
+            enterprises = objects_by_id(
+                await db.execute(enterprises_stmt(row.enterprise_id for row in indicator_values)), schemas.EnterpriseSchema
+            )
+        if "indicator" in selected_fields:
+            indicators = objects_by_id(
+                await db.execute(indicators_stmt(row.indicator_id for row in indicator_values)), schemas.IndicatorSchema
+            )
+        if needs_conversion(selected_fields):
+            await db.run_sync(rate_table.ensure_loaded)
+        content = serialize_indicator_value_rows(
+            indicator_values, selected_fields, target_currency, enterprises, indicators
+        )
+
+    return Response(
+        content=content,
+        media_type="application/json",
+        headers=next_cursor_headers(indicator_values, limit)
+    )
+
+
+@router.get(
+    "/weighted-indicators/",
+    response_model=List[schemas.WeightedIndicatorSchema] | schemas.WeightedIndicatorAggregateSchema | List[schemas.WeightedIndicatorGroupSchema],
+    tags=["weighted_indicators"]
+)
+async def get_weighted_indicators(
+    enterprise_id: int = Query(...),
+    indicator_id: int = Query(None),
+    from_date: date = Query(None),
+    to_date: date = Query(None),
+    target_currency: str = Query("RUB"),
+    aggregate: bool = Query(False),
+    group_by: str = Query(None, pattern="^(month|quarter)?$"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    principal=Depends(get_current_async_principal)
+):
+    filters = weighted_filters(enterprise_id, indicator_id, from_date, to_date)
+
+    if group_by:
+        if covers_range(from_date, to_date, group_by):
+            stmt = grouped_totals_stmt(enterprise_id, group_by, target_currency, indicator_id, from_date, to_date)
+            groups = label_grouped_totals((await db.execute(stmt)).all(), group_by)
+        else:
+            groups = (await db.execute(weighted_totals_stmt(filters, target_currency, group_by))).all()
+        return weighted_groups(groups)
+
+    if aggregate:
+        total, missing = (await db.execute(weighted_totals_stmt(filters, target_currency))).one()
+        return weighted_aggregate(total, missing)
+
+    rows = (await db.execute(weighted_rows_stmt(filters, skip, limit))).all()
+    await db.run_sync(rate_table.ensure_loaded)
+    return weighted_rows(rows, target_currency)
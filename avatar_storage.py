@@ -0,0 +1,168 @@
+"""Хранилища аватаров пользователей.
+
+AVATAR_STORAGE=local|cloudinary; по умолчанию cloudinary, если задан
+CLOUDINARY_CLOUD_NAME, иначе файлы кладутся в uploads/avatars и отдаются
+через /uploads. Размер тела загрузки ограничивается ещё при чтении из сокета
+(AvatarUploadLimitMiddleware). Все блокирующие операции (диск, HTTP к Cloudinary) выполняются
+в пуле потоков, чтобы медленная загрузка не останавливала event loop воркера.
+"""
+import os
+import uuid
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.formparsers import MultiPartException
+
+load_dotenv()
+
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+AVATAR_CHUNK_SIZE = 64 * 1024
+AVATAR_DIR = Path(os.getenv("AVATAR_DIR", "uploads/avatars"))
+# Префикс URL для локальных файлов; пустой — путь относительно API (/uploads/avatars/...)
+AVATAR_BASE_URL = os.getenv("AVATAR_BASE_URL", "").rstrip("/") + "/uploads/avatars"
+ALLOWED_AVATAR_TYPES = {"image/jpeg": "jpg", "image/png": "png"}
+AVATAR_UPLOAD_PATH = "/users/me/avatar"
+# Запас на границы и заголовки multipart поверх размера самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+TOO_LARGE_DETAIL = f"File size exceeds {AVATAR_MAX_BYTES // (1024 * 1024)} MB"
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=400, detail=TOO_LARGE_DETAIL)
+
+
+def _file_size(src: BinaryIO) -> int:
+    src.seek(0, os.SEEK_END)
+    size = src.tell()
+    src.seek(0)
+    return size
+
+
+class AvatarStorage(ABC):
+    @abstractmethod
+    async def save(self, file: UploadFile, user_id: int) -> str:
+        """Сохраняет файл и возвращает URL аватара."""
+
+    async def delete(self, url: str, user_id: int) -> None:
+        """Удаляет прежний аватар пользователя, если он лежит в этом хранилище."""
+
+
+class LocalAvatarStorage(AvatarStorage):
+    def __init__(self, directory: Path = AVATAR_DIR, base_url: str = AVATAR_BASE_URL):
+        self.directory = directory
+        self.base_url = base_url
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    async def save(self, file: UploadFile, user_id: int) -> str:
+        name = f"{user_id}-{uuid.uuid4().hex}.{ALLOWED_AVATAR_TYPES[file.content_type]}"
+        await run_in_threadpool(self._copy, file.file, self.directory / name)
+        return f"{self.base_url}/{name}"
+
+    def _copy(self, src: BinaryIO, target: Path) -> None:
+        # Пишем во временный файл по частям и прерываемся, как только превышен лимит;
+        # под итоговым именем файл появляется только целиком
+        partial = target.with_name(target.name + ".part")
+        written = 0
+        try:
+            with open(partial, "wb") as dst:
+                while chunk := src.read(AVATAR_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > AVATAR_MAX_BYTES:
+                        raise _too_large()
+                    dst.write(chunk)
+            partial.replace(target)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+
+    async def delete(self, url: str, user_id: int) -> None:
+        # avatar_url пользователь может записать сам через PUT /users/me, поэтому
+        # удаляются только файлы, имя которых начинается с его id (см. save)
+        prefix = self.base_url + "/"
+        name = url[len(prefix):] if url.startswith(prefix) else ""
+        if name.startswith(f"{user_id}-") and "/" not in name and "\\" not in name:
+            await run_in_threadpool((self.directory / name).unlink, missing_ok=True)
+
+
+class CloudinaryAvatarStorage(AvatarStorage):
+    def __init__(self):
+        # Необязательная зависимость: нужна только при AVATAR_STORAGE=cloudinary
+        import cloudinary
+        import cloudinary.uploader
+
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET")
+        )
+        self._uploader = cloudinary.uploader
+
+    async def save(self, file: UploadFile, user_id: int) -> str:
+        return await run_in_threadpool(self._upload, file.file)
+
+    def _upload(self, src: BinaryIO) -> str:
+        # Тело уже во временном файле Starlette: размер известен без чтения в память,
+        # а uploader читает файл сам
+        if _file_size(src) > AVATAR_MAX_BYTES:
+            raise _too_large()
+        result = self._uploader.upload(src, folder="avatars", resource_type="image")
+        return result["secure_url"]
+
+
+@lru_cache(maxsize=None)
+def get_avatar_storage() -> AvatarStorage:
+    backend = os.getenv("AVATAR_STORAGE") or ("cloudinary" if os.getenv("CLOUDINARY_CLOUD_NAME") else "local")
+    print(f"[Avatars] Хранилище: {backend}")
+    if backend == "cloudinary":
+        return CloudinaryAvatarStorage()
+    if backend == "local":
+        return LocalAvatarStorage()
+    raise ValueError(f"Unknown AVATAR_STORAGE: {backend}")
+
+
+class AvatarUploadLimitMiddleware:
+    """Ограничивает тело POST /users/me/avatar до AVATAR_MAX_BYTES (+ запас на multipart).
+
+    Content-Length больше лимита отклоняется сразу. Без Content-Length (chunked) или
+    при неверном значении байты считаются по мере чтения тела: как только лимит
+    превышен, разбор multipart прерывается и остаток тела не читается и не пишется
+    во временный файл.
+    """
+
+    def __init__(self, app, max_body: int = AVATAR_MAX_BYTES + MULTIPART_OVERHEAD):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != AVATAR_UPLOAD_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        length = Headers(scope=scope).get("content-length")
+        if length is not None and (not length.isdigit() or int(length) > self.max_body):
+            await JSONResponse(status_code=400, content={"detail": TOO_LARGE_DETAIL})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # MultiPartParser закрывает временные файлы, Request.form() превращает
+                    # исключение в HTTPException 400 с этим текстом
+                    raise MultiPartException(TOO_LARGE_DETAIL)
+            return message
+
+        await self.app(scope, limited_receive, send)
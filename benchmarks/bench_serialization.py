@@ -0,0 +1,99 @@
+"""Сравнение сериализации ответа /indicator-values/: старый путь через pydantic и новый через orjson.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_serialization.py --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import models  # noqa: E402
+import schemas  # noqa: E402
+from rate_cache import convert_value, rate_table  # noqa: E402
+from serializers import serialize_indicator_values  # noqa: E402
+
+
+def build_rows(count: int, enterprises: int, indicators: int) -> List[models.IndicatorValue]:
+    enterprise_objs = [
+        models.Enterprise(id=i, name=f"Enterprise {i}", requisites="-", phone="-", contact_person="-")
+        for i in range(1, enterprises + 1)
+    ]
+    indicator_objs = [
+        models.Indicator(id=i, name=f"Indicator {i}", importance=Decimal("1.5"), unit="шт")
+        for i in range(1, indicators + 1)
+    ]
+    start = date(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        value_date = start + timedelta(days=i % 365)
+        rate_table.set("USD", "RUB", value_date, 90.0)
+        enterprise = enterprise_objs[i % enterprises]
+        indicator = indicator_objs[i % indicators]
+        rows.append(models.IndicatorValue(
+            id=i + 1,
+            enterprise_id=enterprise.id,
+            indicator_id=indicator.id,
+            value=Decimal("1234.56"),
+            value_date=value_date,
+            currency_code="USD" if i % 2 else "RUB",
+            enterprise=enterprise,
+            indicator=indicator,
+        ))
+    return rows
+
+
+def legacy(rows, target_currency: str) -> bytes:
+    # Путь до перехода на serializers: from_orm → dict → повторная валидация,
+    # затем проверка response_model и jsonable_encoder + json.dumps
+    result = []
+    for item in rows:
+        base = schemas.IndicatorValueWithObjects.from_orm(item).dict()
+        base["converted_value"], base["warning"] = convert_value(
+            item.value, item.currency_code, item.value_date, target_currency
+        )
+        result.append(schemas.IndicatorValueWithObjects(**base))
+    validated = TypeAdapter(List[schemas.IndicatorValueWithObjects]).validate_python(result)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def measure(fn, rows, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        fn(rows, "RUB")
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--enterprises", type=int, default=50)
+    parser.add_argument("--indicators", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = build_rows(args.rows, args.enterprises, args.indicators)
+    assert json.loads(legacy(rows, "RUB")) == json.loads(serialize_indicator_values(rows, "RUB"))
+
+    for name, fn in (("legacy", legacy), ("orjson", serialize_indicator_values)):
+        best = measure(fn, rows, args.repeat)
+        print(f"{name:>8}: {best * 1000:8.1f} ms всего, {best / args.rows * 1e6:6.2f} µs/строка")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Прогон сценариев API на базе, заполненной benchmarks/seed.py.
+
+Запросы идут через TestClient в том же процессе, внешний API курсов подменяется
+локальным сервером (EXCHANGE_API_URL). Для каждого сценария пишутся p50/p99,
+пропускная способность и число SQL-запросов на HTTP-запрос.
+
+    python benchmarks/run.py --database-url sqlite:////tmp/bench.db --output /tmp/baseline.json
+
+Сравнимые цифры даёт только PostgreSQL: на SQLite свёртки не строятся (weighted_month
+и weighted_quarter читают пустую свёртку), а сценарии из POSTGRES_ONLY (upsert,
+date_trunc) пропускаются и попадают в отчёт как {"skipped": ...}.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from seed import BENCH_PASSWORD, BENCH_USERNAME  # noqa: E402
+
+# Сценарии, которые на SQLite заканчиваются 500 и не дают осмысленных замеров
+POSTGRES_ONLY = {
+    "update_exchange_rates": "upsert курсов и пересчёт свёртки (date_trunc) есть только в PostgreSQL",
+}
+
+
+class FakeRatesHandler(BaseHTTPRequestHandler):
+    """Отвечает в формате exchangerate.host: GET /{YYYY-MM-DD}?base=RUB&symbols=USD,EUR."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            day = date.fromisoformat(url.path.strip("/"))
+        except ValueError:
+            self.send_error(404)
+            return
+        symbols = parse_qs(url.query).get("symbols", [""])[0].split(",")
+        # Детерминированный курс, зависящий от даты
+        rates = {symbol: round(0.01 + (day.toordinal() % 100) / 100000 + i / 1000, 6) for i, symbol in enumerate(symbols) if symbol}
+        body = json.dumps({"base": "RUB", "date": day.isoformat(), "rates": rates}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_rates_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRatesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="по умолчанию DATABASE_URL")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--slow-iterations", type=int, default=10, help="для /token и /update-exchange-rates/")
+    parser.add_argument("--enterprise-id", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="запустить только перечисленные сценарии")
+    parser.add_argument("--output", help="файл JSON-отчёта; по умолчанию stdout")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+    return args
+
+
+def build_scenarios(args, first_day: date, last_day: date):
+    enterprise = {"enterprise_id": args.enterprise_id}
+    # Границы по целым месяцам/кварталам, чтобы сгруппированные запросы могли читать свёртку
+    month_to = last_day.replace(day=1) - timedelta(days=1)
+    quarter_to = date(last_day.year, 3 * ((last_day.month - 1) // 3) + 1, 1) - timedelta(days=1)
+    next_rate_day = iter(last_day + timedelta(days=i) for i in range(1, 100000))
+
+    return [
+        ("indicator_values", "GET", "/indicator-values/", lambda: {"params": {**enterprise, "limit": 100}}, args.iterations),
+        ("indicator_values_range", "GET", "/indicator-values/",
+         lambda: {"params": {**enterprise, "indicator_id": 1, "from_date": first_day.isoformat(), "to_date": month_to.isoformat(), "limit": 100}}, args.iterations),
+        ("indicator_values_flat", "GET", "/indicator-values/",
+         lambda: {"params": {**enterprise, "limit": 1000, "shape": "flat", "fields": "value_date,value,converted_value"}}, args.iterations),
+        ("weighted_plain", "GET", "/weighted-indicators/", lambda: {"params": {**enterprise, "limit": 100}}, args.iterations),
+        ("weighted_aggregate", "GET", "/weighted-indicators/", lambda: {"params": {**enterprise, "aggregate": True}}, args.iterations),
+        ("weighted_month", "GET", "/weighted-indicators/",
+         lambda: {"params": {**enterprise, "group_by": "month", "from_date": first_day.isoformat(), "to_date": month_to.isoformat()}}, args.iterations),
+        ("weighted_quarter", "GET", "/weighted-indicators/",
+         lambda: {"params": {**enterprise, "group_by": "quarter", "from_date": first_day.isoformat(), "to_date": quarter_to.isoformat()}}, args.iterations),
+        ("update_exchange_rates", "POST", "/update-exchange-rates/",
+         lambda: {"params": {"target_date": next(next_rate_day).isoformat()}}, args.slow_iterations),
+        ("token", "POST", "/token", lambda: {"data": {"username": BENCH_USERNAME, "password": BENCH_PASSWORD}}, args.slow_iterations),
+    ]
+
+
+def run_scenario(client, recorder, method, path, make_request, iterations, warmup, headers):
+    for _ in range(warmup):
+        client.request(method, path, headers=headers, **make_request())
+
+    latencies, queries, status_codes = [], [], {}
+    started = perf_counter()
+    for _ in range(iterations):
+        request = make_request()
+        recorder.statements.clear()
+        call_started = perf_counter()
+        response = client.request(method, path, headers=headers, **request)
+        latencies.append((perf_counter() - call_started) * 1000)
+        queries.append(len(recorder))
+        status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+    elapsed = perf_counter() - started
+
+    return {
+        "iterations": iterations,
+        "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+        "errors": sum(count for code, count in status_codes.items() if code >= 400),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "max_ms": round(max(latencies), 3),
+        "throughput_rps": round(iterations / elapsed, 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2),
+        "max_queries": max(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    server = start_fake_rates_server()
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["EXCHANGE_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["EXCHANGE_API_RPS"] = "0"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, func
+
+    import main as app_main
+    import models
+    from hashing import hashing_pool
+    from query_budget import QueryRecorder
+
+    db = models.SessionLocal()
+    try:
+        first_day, last_day = db.query(
+            func.min(models.IndicatorValue.value_date), func.max(models.IndicatorValue.value_date)
+        ).one()
+        if first_day is None:
+            raise SystemExit("No indicator values; run benchmarks/seed.py first")
+        dataset = {
+            "enterprises": db.query(func.count(models.Enterprise.id)).scalar(),
+            "indicators": db.query(func.count(models.Indicator.id)).scalar(),
+            "indicator_values": db.query(func.count(models.IndicatorValue.id)).scalar(),
+            "exchange_rates": db.query(func.count(models.ExchangeRate.id)).scalar(),
+            "from_date": first_day.isoformat(),
+            "to_date": last_day.isoformat(),
+        }
+    finally:
+        db.close()
+
+    # Без контекстного менеджера lifespan не запускается: ни планировщика, ни синхронизации при старте
+    client = TestClient(app_main.app, raise_server_exceptions=False)
+    token = client.post("/token", data={"username": BENCH_USERNAME, "password": BENCH_PASSWORD})
+    if token.status_code != 200:
+        raise SystemExit(f"Login failed: {token.status_code} {token.text}")
+    headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+
+    recorder = QueryRecorder()
+    event.listen(models.engine, "before_cursor_execute", recorder.record)
+    results = {}
+    try:
+        for name, method, path, make_request, iterations in build_scenarios(args, first_day, last_day):
+            if args.only and name not in args.only:
+                continue
+            if name in POSTGRES_ONLY and models.engine.dialect.name != "postgresql":
+                results[name] = {"skipped": POSTGRES_ONLY[name]}
+                print(f"[Bench] {name}: пропущен на {models.engine.dialect.name}", file=sys.stderr)
+                continue
+            warmup = 0 if name == "update_exchange_rates" else args.warmup
+            try:
+                results[name] = run_scenario(client, recorder, method, path, make_request, iterations, warmup, headers)
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"[Bench] {name}: {results[name]}", file=sys.stderr)
+    finally:
+        event.remove(models.engine, "before_cursor_execute", recorder.record)
+        hashing_pool.shutdown()
+        server.shutdown()
+
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "database": models.engine.dialect.name,
+        "db_mode": models.DB_MODE,
+        "dataset": dataset,
+        "scenarios": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
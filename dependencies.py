@@ -1,11 +1,16 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from models import SessionLocal, User
+from models import SessionLocal, AsyncSessionLocal, User
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from typing import Optional
+from collections import OrderedDict
+from functools import cached_property
+import hashlib
+import threading
+import time
 import os
 from dotenv import load_dotenv
 
@@ -18,6 +23,7 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -29,24 +35,91 @@ def get_db():
     finally:
         db.close()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+class TokenCache:
+    """Ограниченный LRU-кэш проверенных токенов: sha256(токен) → (user_id, exp)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user_id
+
+    def put(self, key: str, user_id: int, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (user_id, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_access_token(token: str) -> int:
+    key = hashlib.sha256(token.encode()).hexdigest()
+    user_id = token_cache.get(key)
+    if user_id is not None:
+        return user_id
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
+        user_id = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
+            raise _credentials_exception()
         user_id = int(user_id)
-    except (JWTError, ValueError):
-        raise credentials_exception
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        expires_at = float(payload["exp"])
+    except (JWTError, ValueError, KeyError):
+        raise _credentials_exception()
+    token_cache.put(key, user_id, expires_at)
+    return user_id
+
+
+class Principal:
+    """Пользователь из проверенного токена. Строка User загружается только при обращении к .user."""
+
+    def __init__(self, user_id: int, db: Optional[Session]):
+        self.id = user_id
+        self._db = db
+
+    @cached_property
+    def user(self) -> User:
+        user = self._db.query(User).filter(User.id == self.id).first()
+        if user is None:
+            raise _credentials_exception()
+        return user
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    return Principal(decode_access_token(token), db)
+
+async def get_current_async_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    # Без синхронной сессии: асинхронным маршрутам нужен только id пользователя
+    return Principal(decode_access_token(token), None)
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal.user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -0,0 +1,111 @@
+import re
+import threading
+from bisect import bisect_left
+from typing import FrozenSet, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+from queries import enterprise_search_stmt, enterprises_stmt
+
+# Порог похожести совпадает со значением pg_trgm.similarity_threshold по умолчанию,
+# поэтому запасной индекс в памяти находит те же названия, что и оператор %
+SIMILARITY_THRESHOLD = 0.3
+
+_WORD = re.compile(r"\w+")
+
+
+def trigrams(value: str) -> FrozenSet[str]:
+    """Триграммы как в pg_trgm: каждое слово дополняется двумя пробелами слева и одним справа."""
+    result = set()
+    for word in _WORD.findall(value.lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class EnterpriseIndex:
+    """Индекс названий предприятий в памяти процесса, если в БД нет pg_trgm.
+
+    Названия в нижнем регистре лежат в отсортированном списке: префиксный поиск —
+    бинарный поиск границы диапазона. Индекс перестраивается, когда меняется версия
+    справочника enterprises (etags.bump_version), в том числе после записи в другом воркере.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Tuple[List[str], List[int], List[FrozenSet[str]]] = ([], [], [])
+        self._version: Optional[int] = None
+
+    def ensure_loaded(self, db: Session, version: int) -> None:
+        if self._version != version:
+            self.reload(db, version)
+
+    def reload(self, db: Session, version: int) -> None:
+        rows = sorted(
+            (name.lower(), id) for id, name in db.query(models.Enterprise.id, models.Enterprise.name)
+            if name is not None
+        )
+        entries = ([name for name, _ in rows], [id for _, id in rows], [trigrams(name) for name, _ in rows])
+        with self._lock:
+            self._entries = entries
+            self._version = version
+        print(f"[Enterprise Search] Индекс перестроен: {len(rows)} предприятий, версия {version}")
+
+    def search(self, query: str, skip: int, limit: int) -> List[int]:
+        """id предприятий в том же порядке, что и enterprise_search_stmt."""
+        names, ids, grams = self._entries
+        query = query.lower()
+        start = end = bisect_left(names, query)
+        while end < len(names) and names[end].startswith(query):
+            end += 1
+        ranked = ids[start:end]
+        if len(ranked) >= skip + limit:
+            return ranked[skip:skip + limit]
+
+        query_grams = trigrams(query)
+        similar = []
+        for i in range(len(names)):
+            if start <= i < end:
+                continue
+            score = similarity(query_grams, grams[i])
+            if score >= SIMILARITY_THRESHOLD:
+                similar.append((-score, names[i], ids[i]))
+        similar.sort()
+        ranked.extend(id for _, _, id in similar)
+        return ranked[skip:skip + limit]
+
+
+enterprise_index = EnterpriseIndex()
+
+# Проверяется один раз на процесс: расширение ставится миграцией до запуска приложения
+_trgm_available: Optional[bool] = None
+
+
+def trgm_available(db: Session) -> bool:
+    global _trgm_available
+    if _trgm_available is None:
+        _trgm_available = db.get_bind().dialect.name == "postgresql" and bool(db.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        ).scalar())
+    return _trgm_available
+
+
+def search_enterprises(db: Session, query: str, skip: int, limit: int, version: int) -> Sequence:
+    """Строки предприятий для /enterprises/search; version — текущая версия справочника enterprises."""
+    if trgm_available(db):
+        return db.execute(enterprise_search_stmt(query, skip, limit)).all()
+
+    enterprise_index.ensure_loaded(db, version)
+    ids = enterprise_index.search(query, skip, limit)
+    if not ids:
+        return []
+    rows = {row.id: row for row in db.execute(enterprises_stmt(ids))}
+    return [rows[id] for id in ids if id in rows]
@@ -0,0 +1,69 @@
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Справочники, для которых списки отдаются с ETag
+RESOURCES = ("enterprises", "indicators", "currencies", "exchange_rates")
+
+# Cache-Control для каждого справочника: CACHE_CONTROL_<RESOURCE>, например
+# CACHE_CONTROL_CURRENCIES="private, max-age=300". По умолчанию клиент
+# хранит ответ, но перепроверяет его при каждом запросе.
+DEFAULT_CACHE_CONTROL = os.getenv("CACHE_CONTROL_DEFAULT", "private, no-cache")
+CACHE_CONTROL = {
+    resource: os.getenv(f"CACHE_CONTROL_{resource.upper()}", DEFAULT_CACHE_CONTROL)
+    for resource in RESOURCES
+}
+
+
+def bump_version(db: Session, resource: str) -> None:
+    """Увеличивает версию справочника в текущей транзакции; коммит остаётся за вызывающим."""
+    result = db.execute(
+        update(models.ResourceVersion)
+        .where(models.ResourceVersion.resource == resource)
+        .values(version=models.ResourceVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        # Строка создаётся миграцией; сюда попадаем только на базе из create_all
+        db.execute(insert(models.ResourceVersion).values(resource=resource, version=1))
+
+
+def version_stmt(resource: str):
+    return select(models.ResourceVersion.version).where(models.ResourceVersion.resource == resource)
+
+
+def get_version(db: Session, resource: str) -> int:
+    return db.execute(version_stmt(resource)).scalar() or 0
+
+
+def make_etag(resource: str, version: int) -> str:
+    return f'"{resource}-{version}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified(request: Request, response: Response, db: Session, resource: str) -> Optional[Response]:
+    """Ставит ETag и Cache-Control на ответ списка; при совпадении If-None-Match возвращает 304.
+
+    Версия читается до самой таблицы: если запись произойдёт между двумя запросами,
+    клиент получит новые данные со старым ETag и просто перечитает их в следующий раз.
+    """
+    return check_etag(request, response, resource, get_version(db, resource))
+
+
+def check_etag(request: Request, response: Response, resource: str, version: int) -> Optional[Response]:
+    etag = make_etag(resource, version)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL[resource]}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,127 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from typing import Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from passlib.exc import UnknownHashError
+
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+
+# Отдельный контекст, чтобы дочерним процессам не нужно было импортировать
+# dependencies/models (и подключаться к БД) при запуске через spawn
+_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> str:
+    return _context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> Optional[bool]:
+    try:
+        return _context.verify(password, hashed_password)
+    except (UnknownHashError, ValueError):
+        return None
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервер перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
+
+
+class HashingPool:
+    """Пул процессов для bcrypt с ограничением очереди.
+
+    Хэширование не занимает общий пул потоков anyio, на котором работают
+    синхронные маршруты. Если задач больше, чем queue_limit, запрос сразу
+    получает 503 вместо того, чтобы ждать в очереди.
+    """
+
+    def __init__(self, workers: int = HASH_POOL_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Пул создаётся лениво, уже внутри процесса воркера uvicorn. Процессы запускаются
+        # через spawn: fork копировал бы потоки и открытые соединения пула БД воркера
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                self.rejected += 1
+                raise _unavailable()
+            self.pending += 1
+            executor = self._get_executor()
+        started = perf_counter()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            # Дочерний процесс упал (OOM, kill): такой пул больше не принимает задачи,
+            # поэтому он сбрасывается и следующий запрос создаст новый
+            self._discard_executor(executor)
+            print("[Hashing] Пул процессов сломан, будет создан заново")
+            raise _unavailable()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.total_ms += (perf_counter() - started) * 1000
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            # Пул мог уже пересоздать другой запрос, получивший ту же ошибку
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": min(self.pending, self.workers),
+                "queued": max(self.pending - self.workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_ms / self.completed, 2) if self.completed else None,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+hashing_pool = HashingPool()
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    result = await hashing_pool.run(_verify, password, hashed_password)
+    if result is None:
+        raise UnknownHashError("Unknown password hash format")
+    return result
@@ -0,0 +1,78 @@
+import zlib
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Callable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+
+def _lock_key(job_name: str) -> int:
+    return zlib.crc32(job_name.encode())
+
+
+def run_exclusive(
+    job_name: str,
+    job: Callable[[Session], Optional[str]],
+    min_interval: timedelta = timedelta(0),
+) -> Optional[str]:
+    """Запускает задачу ровно в одном воркере кластера и записывает результат в job_runs.
+
+    Взаимоисключение держится на сессионной advisory-блокировке Postgres: воркер,
+    не получивший блокировку, сразу пропускает запуск. Если успешный запуск уже
+    завершился меньше min_interval назад, задача тоже пропускается — так воркеры,
+    опоздавшие к блокировке на секунды, не повторяют только что сделанную работу.
+    """
+    engine = models.engine
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        postgres = engine.dialect.name == "postgresql"
+        if postgres and not lock_conn.execute(select(func.pg_try_advisory_lock(_lock_key(job_name)))).scalar():
+            print(f"[Jobs] {job_name}: выполняется в другом воркере, пропускаем")
+            return None
+        try:
+            return _run_and_record(job_name, job, min_interval)
+        finally:
+            if postgres:
+                lock_conn.execute(select(func.pg_advisory_unlock(_lock_key(job_name))))
+
+
+def _run_and_record(job_name, job, min_interval) -> Optional[str]:
+    db = models.SessionLocal()
+    try:
+        if min_interval:
+            last_success = db.execute(
+                select(func.max(models.JobRun.finished_at)).where(
+                    models.JobRun.job_name == job_name,
+                    models.JobRun.status == "success"
+                )
+            ).scalar()
+            if last_success and datetime.utcnow() - last_success < min_interval:
+                print(f"[Jobs] {job_name}: успешно выполнялась в {last_success}, пропускаем")
+                return None
+
+        run = models.JobRun(job_name=job_name, started_at=datetime.utcnow(), status="running")
+        db.add(run)
+        db.commit()
+
+        started = perf_counter()
+        try:
+            detail = job(db)
+            run.status = "success"
+            run.detail = detail
+        except Exception as e:
+            db.rollback()
+            print(f"[Jobs] {job_name}: ошибка: {e}")
+            run.status = "failed"
+            run.detail = str(e)
+            raise
+        finally:
+            run.finished_at = datetime.utcnow()
+            run.duration_ms = int((perf_counter() - started) * 1000)
+            db.add(run)
+            db.commit()
+        print(f"[Jobs] {job_name}: выполнено за {run.duration_ms} мс. {detail or ''}")
+        return detail
+    finally:
+        db.close()
@@ -1,17 +1,102 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from routers import router
-from models import Base, engine
-import models
-from dependencies import get_db
-from sqlalchemy.orm import Session
+from async_routers import router as async_router
+from models import Base, engine, async_engine, DB_MODE
+from pagination import NEXT_CURSOR_HEADER
+from rate_sync import sync_exchange_rates
+from jobs import run_exclusive
+from partitions import ensure_future_partitions
+from hashing import hashing_pool
+from db_pool import pool_stats
+from metrics import instrument_engine, metrics_middleware, render_metrics
+import query_budget
+from avatar_storage import AvatarUploadLimitMiddleware
 from pathlib import Path
 from apscheduler.schedulers.background import BackgroundScheduler
-import requests
-from datetime import date
+from datetime import date, datetime, timedelta
+import os
 
-app = FastAPI()
+RATE_SYNC_JOB = "exchange_rates_sync"
+PARTITIONS_JOB = "indicator_values_partitions"
+# Повторный запуск синхронизации при старте воркера не нужен, если она недавно прошла успешно
+STARTUP_RATE_SYNC_INTERVAL = timedelta(minutes=int(os.getenv("STARTUP_RATE_SYNC_INTERVAL_MINUTES", "10")))
+
+def auto_update_exchange_rates():
+    try:
+        print(f"[APScheduler] Updating exchange rates for {date.today().isoformat()}")
+        run_exclusive(RATE_SYNC_JOB, sync_exchange_rates, min_interval=timedelta(hours=1))
+    except Exception as e:
+        print(f"[APScheduler] ERROR: {e}")
+
+def maintain_partitions():
+    try:
+        run_exclusive(PARTITIONS_JOB, ensure_future_partitions, min_interval=timedelta(hours=12))
+    except Exception as e:
+        print(f"[Partitions] ERROR: {e}")
+
+def start_scheduler():
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(auto_update_exchange_rates, "cron", hour=1, coalesce=True)
+    scheduler.add_job(maintain_partitions, "cron", hour=2, coalesce=True)
+    scheduler.start()
+    return scheduler
+
+# Состояние фоновой синхронизации курсов при запуске, отдаётся через /ready
+rate_sync_state = {"state": "pending", "started_at": None, "finished_at": None, "error": None}
+
+def sync_rates_after_startup():
+    rate_sync_state.update(state="running", started_at=datetime.utcnow().isoformat())
+    try:
+        detail = run_exclusive(RATE_SYNC_JOB, sync_exchange_rates, min_interval=STARTUP_RATE_SYNC_INTERVAL)
+        rate_sync_state["state"] = "done" if detail is not None else "skipped"
+    except Exception as e:
+        print(f"[Startup] Ошибка синхронизации курсов: {e}")
+        rate_sync_state.update(state="failed", error=str(e))
+    finally:
+        rate_sync_state["finished_at"] = datetime.utcnow().isoformat()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    Base.metadata.create_all(bind=engine)
+    scheduler = start_scheduler()
+    # Внешний API не задерживает запуск: сервер принимает запросы, пока курсы догружаются в фоне
+    sync_task = asyncio.create_task(asyncio.to_thread(sync_rates_after_startup))
+    # Секции на следующий год появляются заранее, даже если воркер не доживёт до ночного запуска
+    partitions_task = asyncio.create_task(asyncio.to_thread(maintain_partitions))
+    yield
+    scheduler.shutdown(wait=False)
+    hashing_pool.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+    if not sync_task.done():
+        print("[Shutdown] Синхронизация курсов ещё выполняется")
+    if not partitions_task.done():
+        print("[Shutdown] Обслуживание секций ещё выполняется")
+
+app = FastAPI(lifespan=lifespan)
+
+# Слишком большой аватар отклоняется по ходу чтения тела, до сохранения всего файла.
+# Регистрируется первым, то есть ближе всех к маршрутам: BaseHTTPMiddleware ниже
+# заворачивает исключения из receive в ExceptionGroup, и разбор формы не увидел бы 400
+app.add_middleware(AvatarUploadLimitMiddleware)
+
+# Гистограммы задержек по маршрутам, счётчики запросов к БД и заголовок Server-Timing
+instrument_engine(engine, "sync")
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
+app.middleware("http")(metrics_middleware)
+
+# На стенде QUERY_BUDGET=<N> пишет в лог запросы к API, сделавшие больше N SQL-запросов
+if query_budget.QUERY_BUDGET:
+    query_budget.install(engine)
+    if async_engine is not None:
+        query_budget.install(async_engine.sync_engine)
+    app.middleware("http")(query_budget.query_budget_middleware)
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
@@ -25,102 +110,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
 
-Base.metadata.create_all(bind=engine)
+# В режиме DB_MODE=async маршруты чтения из async_routers перехватывают те же пути
+# раньше синхронных; в документации остаются описания из routers.py
+if DB_MODE == "async":
+    app.include_router(async_router, include_in_schema=False)
 app.include_router(router)
 
-def auto_update_exchange_rates():
-    today = date.today().isoformat()
-    try:
-        print(f"[APScheduler] Updating exchange rates for {today}")
-        response = requests.post(f"http://localhost:8000/update-exchange-rates/?target_date={today}")
-        print(f"[APScheduler] Done. Status code: {response.status_code}")
-    except Exception as e:
-        print(f"[APScheduler] ERROR: {e}")
+@app.get("/ready", tags=["health"], summary="Readiness check")
+def readiness():
+    return {"status": "ready", "rate_sync": rate_sync_state}
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(auto_update_exchange_rates, "cron", hour=1)
-    scheduler.start()
+@app.get("/metrics/hashing", tags=["health"], summary="Password hashing queue metrics")
+def hashing_metrics():
+    return hashing_pool.stats()
+
+
+def _pool_stats():
+    stats = {"sync": pool_stats(engine.pool)}
+    if async_engine is not None:
+        stats["async"] = pool_stats(async_engine.pool)
+    return stats
+
+@app.get("/metrics/db-pool", tags=["health"], summary="Database connection pool metrics")
+def db_pool_metrics():
+    return _pool_stats()
 
-def update_rates_on_startup():
-    db: Session = next(get_db())
-    today = date.today()
-    existing = db.query(models.ExchangeRate).filter(models.ExchangeRate.rate_date == today).first()
-    if existing:
-        print(f"[Startup] Курсы на {today} уже есть. Обновление не требуется.")
-        return
-    print(f"[Startup] Курсы на {today} отсутствуют. Загружаем...")
-    url = f"https://api.exchangerate.host/{today.isoformat()}?base=RUB&symbols=USD,EUR"
-    response = requests.get(url)
-    if not response.ok:
-        print("[Startup] Ошибка при получении курсов валют.")
-        return
-    data = response.json()
-    rates = data.get("rates", {})
-    for to_currency, rate in rates.items():
-        db_rate = models.ExchangeRate(
-            from_currency="RUB",
-            to_currency=to_currency,
-            rate=rate,
-            rate_date=today
-        )
-        db.add(db_rate)
-    db.commit()
-    print(f"[Startup] Курсы валют на {today} успешно загружены.")
-
-def update_missing_exchange_rates_for_indicator_values():
-    db: Session = next(get_db())
-    base_currency = "RUB"
-
-    needed = db.query(
-        models.IndicatorValue.currency_code,
-        models.IndicatorValue.value_date
-    ).filter(models.IndicatorValue.currency_code != base_currency).distinct().all()
-
-    currencies = list(set([c for c, _ in needed]))
-    dates = list(set([d for _, d in needed]))
-
-    if not currencies or not dates:
-        print("[Startup] Нет недостающих валют/дат для загрузки курсов.")
-        return
-
-    print(f"[Startup] Поиск недостающих курсов: валюты={currencies}, даты {min(dates)} → {max(dates)}")
-
-    for currency in currencies:
-        for date in dates:
-            exists = db.query(models.ExchangeRate).filter_by(
-                from_currency=currency,
-                to_currency=base_currency,
-                rate_date=date
-            ).first()
-            if exists:
-                continue
-
-            url = f"https://api.exchangerate.host/{date.isoformat()}?base={currency}&symbols={base_currency}"
-            response = requests.get(url)
-            if not response.ok:
-                print(f"[Startup] ❌ Не удалось загрузить курс для {currency} на {date}")
-                continue
-
-            data = response.json().get("rates", {})
-            rate = data.get(base_currency)
-            if rate is None:
-                print(f"[Startup] ❌ Курс не найден: {currency} → {base_currency} на {date}")
-                continue
-
-            db.add(models.ExchangeRate(
-                from_currency=currency,
-                to_currency=base_currency,
-                rate_date=date,
-                rate=rate
-            ))
-            print(f"[Startup] ✔ {currency} → {base_currency} на {date} = {rate}")
-
-    db.commit()
-
-
-start_scheduler()
-update_rates_on_startup()
-update_missing_exchange_rates_for_indicator_values()
+@app.get("/metrics", tags=["health"], summary="Prometheus metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(
+        render_metrics(_pool_stats(), hashing_pool.stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,183 @@
+"""Метрики в формате Prometheus без внешних зависимостей.
+
+Значения хранятся в памяти процесса: при нескольких воркерах uvicorn каждый
+отдаёт свои, Prometheus суммирует их по instance.
+"""
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels → [счётчики по корзинам..., сумма, количество]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            base = _labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{base},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}'
+            yield f"{self.name}_sum{{{base}}} {series[-2]}"
+            yield f"{self.name}_count{{{base}}} {series[-1]}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{{{_labels(self.label_names, labels)}}} {value}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса", ("method", "route", "status"), LATENCY_BUCKETS
+)
+request_db_time = Histogram(
+    "http_request_db_duration_seconds", "Время запросов к БД в рамках HTTP-запроса", ("method", "route"), LATENCY_BUCKETS
+)
+request_db_queries = Histogram(
+    "http_request_db_queries", "Число запросов к БД на HTTP-запрос", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+db_queries_total = Counter("db_queries_total", "Запросы к БД, включая фоновые задачи", ("engine",))
+db_query_seconds_total = Counter("db_query_seconds_total", "Суммарное время запросов к БД", ("engine",))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Статистика текущего HTTP-запроса. Объект изменяемый, поэтому запросы из пула потоков
+# (синхронные маршруты получают копию контекста) попадают в тот же счётчик.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine, name: str = "sync") -> None:
+    """Подключает счётчики запросов к Engine (для AsyncEngine передаётся .sync_engine)."""
+
+    # Время начала хранится в контексте выполнения, а не в conn.info: если запрос падает,
+    # after_cursor_execute не вызывается, и на соединении из пула не остаётся мусора
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context._query_started
+        db_queries_total.inc((name,))
+        db_query_seconds_total.inc((name,), elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+async def metrics_middleware(request: Request, call_next):
+    stats = RequestStats()
+    token = current_request.set(stats)
+    started = perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+    finally:
+        elapsed = perf_counter() - started
+        current_request.reset(token)
+        # Шаблон пути, а не фактический URL, чтобы число рядов не росло с каждым id
+        route = request.scope.get("route")
+        route_label = getattr(route, "path", "unmatched")
+        request_latency.observe((request.method, route_label, status), elapsed)
+        request_db_time.observe((request.method, route_label), stats.db_seconds)
+        request_db_queries.observe((request.method, route_label), stats.queries)
+
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f"app;dur={(elapsed - stats.db_seconds) * 1000:.1f}, "
+        f"total;dur={elapsed * 1000:.1f}"
+    )
+    return response
+
+
+# Накопительные поля статистики пула и хэширования: отдаются как counter с суффиксом _total
+STATS_COUNTERS = frozenset(("checkouts", "timeouts", "completed", "rejected"))
+
+
+def _gauges(prefix: str, help: str, label_name: Optional[str], series: Dict[str, dict]) -> Iterable[str]:
+    """Числовые поля словарей статистики как gauge (накопительные — как counter);
+    series — {значение метки: статистика}."""
+    keys = []
+    for stats in series.values():
+        for key, value in stats.items():
+            if key not in keys and isinstance(value, (int, float)) and not isinstance(value, bool):
+                keys.append(key)
+    for key in keys:
+        counter = key in STATS_COUNTERS
+        name = f"{prefix}_{key}_total" if counter else f"{prefix}_{key}"
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} {'counter' if counter else 'gauge'}"
+        for label, stats in series.items():
+            value = stats.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{name}{{{label_name}="{_escape(label)}"}} {value}' if label_name else f"{name} {value}"
+
+
+def render_metrics(pools: Dict[str, dict], hashing: dict) -> str:
+    lines = []
+    for metric in (request_latency, request_db_time, request_db_queries, db_queries_total, db_query_seconds_total):
+        lines.extend(metric.render())
+    lines.extend(_gauges("db_pool", "Состояние пула соединений", "engine", pools))
+    lines.extend(_gauges("password_hashing", "Очередь хэширования паролей", None, {"": hashing}))
+    return "\n".join(lines) + "\n"
@@ -1,9 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Numeric, ForeignKey, Date, Index, UniqueConstraint
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Numeric, ForeignKey, Date, DateTime, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import relationship
+from db_pool import engine_options
 
 load_dotenv()
 
@@ -11,8 +14,32 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in .env file")
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# DB_MODE=async включает асинхронный движок (asyncpg) для маршрутов чтения
+# из async_routers.py. Запись, задачи и свёртки всегда работают через engine.
+DB_MODE = os.getenv("DB_MODE", "sync")
+if DB_MODE not in ("sync", "async"):
+    raise ValueError("DB_MODE must be 'sync' or 'async'")
+
+
+def _async_database_url() -> str:
+    url = os.getenv("ASYNC_DATABASE_URL")
+    if url:
+        return url
+    sync_url = make_url(DATABASE_URL)
+    if sync_url.get_backend_name() != "postgresql":
+        raise ValueError("DB_MODE=async requires PostgreSQL or ASYNC_DATABASE_URL")
+    return sync_url.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_MODE == "async":
+    async_url = _async_database_url()
+    async_engine = create_async_engine(async_url, **engine_options(async_url, is_async=True))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class User(Base):
@@ -30,6 +57,12 @@ class Enterprise(Base):
     phone = Column(String)
     contact_person = Column(String)
 
+    # Фильтр enterprise_name; индексы для /enterprises/search (lower(name) и GIN pg_trgm)
+    # создаются только миграцией f2b7d4a9c6e1
+    __table_args__ = (
+        Index("ix_enterprises_name", "name"),
+    )
+
     indicator_values = relationship("IndicatorValue", back_populates="enterprise")
 
 
@@ -60,19 +93,80 @@ class ExchangeRate(Base):
     )
 
 class IndicatorValue(Base):
+    # В PostgreSQL после миграции c3e8f1a6b5d2 таблица секционирована по годам value_date
+    # с первичным ключом (id, value_date), см. partitions.py; id по-прежнему уникален — он
+    # берётся из одной последовательности, поэтому в ORM ключом остаётся только id
     __tablename__ = "indicator_values"
     id = Column(Integer, primary_key=True)
     enterprise_id = Column(Integer, ForeignKey("enterprises.id"))
     indicator_id = Column(Integer, ForeignKey("indicators.id"))
-    value_date = Column(Date)
+    value_date = Column(Date, nullable=False)
     value = Column(Numeric)
     currency_code = Column(String, ForeignKey("currencies.code"))
 
     __table_args__ = (
-        Index("ix_value_date", "value_date"),
-        Index("ix_enterprise_id", "enterprise_id"),
+        Index("ix_value_date_id", "value_date", "id"),
+        # Фильтр предприятие + показатель + диапазон дат читается только из индекса
+        Index(
+            "ix_indicator_values_ent_ind_date", "enterprise_id", "indicator_id", "value_date",
+            postgresql_include=["value", "currency_code", "id"]
+        ),
         Index("ix_indicator_id", "indicator_id"),
+        UniqueConstraint(
+            "enterprise_id", "indicator_id", "value_date", "value", "currency_code",
+            name="uix_indicator_value"
+        ),
     )
 
     indicator = relationship("Indicator", back_populates="indicator_values")
-    enterprise = relationship("Enterprise", back_populates="indicator_values")
\ No newline at end of file
+    enterprise = relationship("Enterprise", back_populates="indicator_values")
+
+class IndicatorRollup(Base):
+    __tablename__ = "indicator_rollups"
+    id = Column(Integer, primary_key=True)
+    enterprise_id = Column(Integer, ForeignKey("enterprises.id"), nullable=False)
+    indicator_id = Column(Integer, ForeignKey("indicators.id"), nullable=False)
+    period_type = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    # Валюта, в которую сконвертирована сумма (не валюта исходных значений)
+    currency_code = Column(String, nullable=False)
+    total_value = Column(Numeric)
+    value_count = Column(Integer, nullable=False)
+    missing_rate_count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "enterprise_id", "indicator_id", "period_type", "period_start", "currency_code",
+            name="uix_indicator_rollup"
+        ),
+        Index("ix_rollup_enterprise_period", "enterprise_id", "period_type", "currency_code", "period_start"),
+    )
+
+
+class RateBackfillState(Base):
+    __tablename__ = "rate_backfill_state"
+    job_name = Column(String, primary_key=True)
+    status = Column(String, nullable=False)
+    last_completed_date = Column(Date, nullable=True)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    status = Column(String, nullable=False)
+    detail = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_job_runs_name_started", "job_name", "started_at"),
+    )
+
+
+class ResourceVersion(Base):
+    __tablename__ = "resource_versions"
+    resource = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,29 @@
+import base64
+import binascii
+from datetime import date
+from typing import Dict, Sequence, Tuple
+
+from fastapi import HTTPException
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value_date: date, id: int) -> str:
+    raw = f"{value_date.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        value_date, id = raw.split("|")
+        return date.fromisoformat(value_date), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def next_cursor_headers(rows: Sequence, limit: int) -> Dict[str, str]:
+    """X-Next-Cursor для полной страницы; rows — сущности или строки с value_date и id."""
+    if len(rows) == limit and rows[-1].value_date is not None:
+        return {NEXT_CURSOR_HEADER: encode_cursor(rows[-1].value_date, rows[-1].id)}
+    return {}
@@ -0,0 +1,142 @@
+"""Обслуживание годовых секций indicator_values (PostgreSQL, RANGE по value_date).
+
+Секции создаются заранее, на PARTITION_YEARS_AHEAD лет вперёд; строки, для которых
+секции ещё нет, попадают в indicator_values_default и переносятся при создании секции.
+Старый год отключается от таблицы без DELETE и остаётся отдельной таблицей для архива:
+
+    python partitions.py ensure
+    python partitions.py detach 2019
+    pg_dump -t indicator_values_y2019 ... && psql -c "DROP TABLE indicator_values_y2019"
+"""
+import argparse
+import os
+from datetime import date
+from typing import List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+
+PARENT_TABLE = "indicator_values"
+DEFAULT_PARTITION = "indicator_values_default"
+PARTITION_YEARS_AHEAD = int(os.getenv("PARTITION_YEARS_AHEAD", "1"))
+
+
+def partition_name(year: int) -> str:
+    return f"{PARENT_TABLE}_y{year}"
+
+
+def is_partitioned(db: Session) -> bool:
+    """False на SQLite и на базе, где миграция секционирования ещё не применена."""
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table AND c.relnamespace = to_regnamespace(current_schema())
+        )
+    """), {"table": PARENT_TABLE}).scalar()
+
+
+def existing_years(db: Session) -> Set[int]:
+    names = db.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+    """), {"table": PARENT_TABLE}).scalars()
+    prefix = f"{PARENT_TABLE}_y"
+    return {int(name[len(prefix):]) for name in names if name.startswith(prefix)}
+
+
+def create_year_partition(db: Session, year: int) -> None:
+    """Создаёт секцию за год, забирая из секции по умолчанию уже попавшие туда строки.
+
+    Таблица наполняется до ATTACH: иначе Postgres отказался бы подключать секцию,
+    пока в default есть строки из её диапазона.
+    """
+    name = partition_name(year)
+    params = {"start": date(year, 1, 1), "end": date(year + 1, 1, 1)}
+    db.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    moved = db.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE value_date >= :start AND value_date < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), params).rowcount
+    # CHECK совпадает с границами секции — ATTACH не сканирует таблицу повторно
+    db.execute(text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_range "
+        f"CHECK (value_date >= DATE '{params['start']}' AND value_date < DATE '{params['end']}')"
+    ))
+    db.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{params['start']}') TO ('{params['end']}')"
+    ))
+    db.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range"))
+    print(f"[Partitions] Создана секция {name}, перенесено из default: {moved}")
+
+
+def ensure_future_partitions(db: Session, years_ahead: int = PARTITION_YEARS_AHEAD, today: Optional[date] = None) -> Optional[str]:
+    """Досоздаёт секции с текущего года по текущий + years_ahead. Задача для run_exclusive."""
+    if not is_partitioned(db):
+        return None
+    year = (today or date.today()).year
+    existing = existing_years(db)
+    created: List[int] = []
+    for target in range(year, year + years_ahead + 1):
+        if target not in existing:
+            create_year_partition(db, target)
+            created.append(target)
+    db.commit()
+    return f"созданы секции: {created}" if created else "все секции на месте"
+
+
+def detach_year_partition(db: Session, year: int) -> str:
+    """Отключает секцию года от indicator_values и удаляет свёртки за этот год.
+
+    Данные остаются в отдельной таблице indicator_values_y<год> — её можно выгрузить
+    и удалить. Свёртки удаляются, чтобы группировки по месяцам и кварталам не
+    показывали суммы по значениям, которых больше нет в таблице.
+    """
+    name = partition_name(year)
+    if year not in existing_years(db):
+        raise ValueError(f"Секция {name} не найдена")
+    db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    db.query(models.IndicatorRollup).filter(
+        models.IndicatorRollup.period_start >= date(year, 1, 1),
+        models.IndicatorRollup.period_start < date(year + 1, 1, 1)
+    ).delete(synchronize_session=False)
+    db.commit()
+    print(f"[Partitions] Секция {name} отключена, её можно архивировать")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание секций indicator_values")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="создать секции на будущие годы")
+    ensure.add_argument("--years-ahead", type=int, default=PARTITION_YEARS_AHEAD)
+    detach = commands.add_parser("detach", help="отключить секцию года для архивации")
+    detach.add_argument("year", type=int)
+    args = parser.parse_args()
+
+    db = models.SessionLocal()
+    try:
+        if not is_partitioned(db):
+            raise SystemExit("indicator_values is not partitioned; run alembic upgrade head")
+        if args.command == "ensure":
+            print(ensure_future_partitions(db, args.years_ahead))
+        else:
+            detach_year_partition(db, args.year)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
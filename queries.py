@@ -0,0 +1,207 @@
+"""Построители запросов для маршрутов чтения.
+
+Функции только собирают select(); выполнять их может и синхронная Session
+(routers.py), и AsyncSession (async_routers.py).
+"""
+from datetime import date
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import and_, case, func, select, tuple_
+from sqlalchemy.orm import selectinload
+
+import models
+from pagination import decode_cursor
+
+# -----------------------------------
+# Значения показателей
+# -----------------------------------
+
+def indicator_value_filters(
+    enterprise_id: Optional[int],
+    indicator_id: Optional[int],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    currency_code: Optional[str],
+    enterprise_name: Optional[str]
+) -> list:
+    filters = []
+    if enterprise_name:
+        filters.append(models.IndicatorValue.enterprise_id.in_(
+            select(models.Enterprise.id).where(models.Enterprise.name == enterprise_name)
+        ))
+    elif enterprise_id:
+        filters.append(models.IndicatorValue.enterprise_id == enterprise_id)
+    if indicator_id:
+        filters.append(models.IndicatorValue.indicator_id == indicator_id)
+    if from_date:
+        filters.append(models.IndicatorValue.value_date >= from_date)
+    if to_date:
+        filters.append(models.IndicatorValue.value_date <= to_date)
+    if currency_code:
+        filters.append(models.IndicatorValue.currency_code == currency_code)
+    return filters
+
+
+def indicator_values_stmt(filters: list):
+    """ORM-сущности со связанными предприятием и показателем (полный ответ)."""
+    return select(models.IndicatorValue).options(
+        selectinload(models.IndicatorValue.enterprise),
+        selectinload(models.IndicatorValue.indicator)
+    ).where(*filters)
+
+
+def indicator_value_rows_stmt(filters: list, fields: Sequence[str]):
+    """Core select() только нужных столбцов для fields= / shape=flat."""
+    return select(*indicator_value_columns(fields)).where(
+        *filters,
+        models.IndicatorValue.enterprise_id.is_not(None),
+        models.IndicatorValue.indicator_id.is_not(None)
+    )
+
+
+def indicator_value_columns(fields: Sequence[str]) -> list:
+    """Столбцы indicator_values, нужные для выбранных полей, курсора и конвертации."""
+    names = {"id", "value_date"}
+    names.update(name for name in fields if name in models.IndicatorValue.__table__.c)
+    if needs_conversion(fields):
+        names.update(("value", "currency_code"))
+    if "enterprise" in fields:
+        names.add("enterprise_id")
+    if "indicator" in fields:
+        names.add("indicator_id")
+    return [column for column in models.IndicatorValue.__table__.c if column.name in names]
+
+
+def needs_conversion(fields: Sequence[str]) -> bool:
+    return "converted_value" in fields or "warning" in fields
+
+
+def paginate_indicator_values(stmt, cursor: Optional[str], skip: int, limit: int):
+    # Стабильный порядок (value_date, id) по индексу ix_value_date_id: страница по курсору
+    # стоит столько же, сколько первая, независимо от глубины
+    stmt = stmt.order_by(models.IndicatorValue.value_date, models.IndicatorValue.id)
+    if cursor:
+        stmt = stmt.where(
+            tuple_(models.IndicatorValue.value_date, models.IndicatorValue.id) > decode_cursor(cursor)
+        )
+    else:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit)
+
+
+def enterprises_stmt(ids: Iterable[int]):
+    return select(
+        models.Enterprise.id, models.Enterprise.name, models.Enterprise.requisites,
+        models.Enterprise.phone, models.Enterprise.contact_person
+    ).where(models.Enterprise.id.in_(set(ids)))
+
+
+def enterprise_search_stmt(query: str, skip: int, limit: int):
+    """Поиск предприятий по pg_trgm: сначала совпадения по префиксу, затем похожие названия.
+
+    Префикс обслуживает индекс lower(name) text_pattern_ops, оператор % — GIN-индекс
+    триграмм; оба создаются миграцией f2b7d4a9c6e1.
+    """
+    name = func.lower(models.Enterprise.name)
+    query = query.lower()
+    is_prefix = name.like(escape_like(query) + "%", escape="\\")
+    # Префиксные совпадения получают ранг выше любой похожести (она не больше 1)
+    rank = case((is_prefix, 2.0), else_=func.similarity(name, query))
+    return select(
+        models.Enterprise.id, models.Enterprise.name, models.Enterprise.requisites,
+        models.Enterprise.phone, models.Enterprise.contact_person
+    ).where(is_prefix | name.op("%")(query)).order_by(
+        rank.desc(), name, models.Enterprise.id
+    ).offset(skip).limit(limit)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def indicators_stmt(ids: Iterable[int]):
+    return select(
+        models.Indicator.id, models.Indicator.name, models.Indicator.importance, models.Indicator.unit
+    ).where(models.Indicator.id.in_(set(ids)))
+
+# -----------------------------------
+# Взвешенные показатели
+# -----------------------------------
+
+def weighted_filters(
+    enterprise_id: int,
+    indicator_id: Optional[int],
+    from_date: Optional[date],
+    to_date: Optional[date]
+) -> list:
+    filters = [models.IndicatorValue.enterprise_id == enterprise_id]
+    if indicator_id:
+        filters.append(models.IndicatorValue.indicator_id == indicator_id)
+    if from_date:
+        filters.append(models.IndicatorValue.value_date >= from_date)
+    if to_date:
+        filters.append(models.IndicatorValue.value_date <= to_date)
+    return filters
+
+
+def period_expr(group_by: str):
+    if group_by == "month":
+        return func.to_char(models.IndicatorValue.value_date, 'YYYY-MM')
+    return func.concat(
+        func.extract('year', models.IndicatorValue.value_date),
+        '-Q',
+        func.extract('quarter', models.IndicatorValue.value_date)
+    )
+
+
+def weighted_sum_columns(target_currency: str):
+    """Взвешенное значение в целевой валюте и признак отсутствующего курса для одной строки."""
+    weighted_value = models.IndicatorValue.value * models.Indicator.importance
+    same_currency = models.IndicatorValue.currency_code == target_currency
+    converted_value = case(
+        (same_currency, weighted_value),
+        else_=func.round(weighted_value * models.ExchangeRate.rate, 2)
+    )
+    missing_rate = case(
+        (and_(~same_currency, models.ExchangeRate.rate.is_(None)), 1),
+        else_=0
+    )
+    return converted_value, missing_rate
+
+
+def join_weighted_rates(stmt, target_currency: str):
+    return stmt.select_from(models.IndicatorValue).join(
+        models.Indicator, models.IndicatorValue.indicator_id == models.Indicator.id
+    ).outerjoin(
+        models.ExchangeRate,
+        and_(
+            models.ExchangeRate.from_currency == models.IndicatorValue.currency_code,
+            models.ExchangeRate.to_currency == target_currency,
+            models.ExchangeRate.rate_date == models.IndicatorValue.value_date
+        )
+    )
+
+
+def weighted_totals_stmt(filters: list, target_currency: str, group_by: Optional[str] = None):
+    """Сумма (и число значений без курса) целиком или по периодам — одним запросом в БД."""
+    converted_value, missing_rate = weighted_sum_columns(target_currency)
+    columns = [func.sum(converted_value).label("total"), func.sum(missing_rate).label("missing")]
+    if group_by:
+        columns.insert(0, period_expr(group_by).label("period"))
+    stmt = join_weighted_rates(select(*columns), target_currency).where(*filters)
+    if group_by:
+        stmt = stmt.group_by("period").order_by("period")
+    return stmt
+
+
+def weighted_rows_stmt(filters: list, skip: int, limit: int):
+    return select(
+        models.IndicatorValue.indicator_id,
+        models.Indicator.name,
+        models.IndicatorValue.value_date,
+        models.IndicatorValue.value,
+        models.IndicatorValue.currency_code,
+        models.Indicator.importance
+    ).join(
+        models.Indicator, models.IndicatorValue.indicator_id == models.Indicator.id
+    ).where(*filters).offset(skip).limit(limit)
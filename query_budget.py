@@ -0,0 +1,104 @@
+"""Бюджет SQL-запросов на HTTP-запрос.
+
+В тестах:
+
+    with query_budget(3):
+        client.post("/indicator-values/", json=payload)
+
+Блок падает с QueryBudgetExceeded, если к БД ушло больше трёх запросов.
+На стенде QUERY_BUDGET=<N> включает middleware, которое пишет в лог каждый
+запрос к API, превысивший бюджет, вместе с выполненными SQL.
+"""
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import event
+
+import models
+
+# 0 — middleware выключено
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "0"))
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, budget: int, statements: List[str]):
+        self.budget = budget
+        self.statements = statements
+        super().__init__(
+            f"{len(statements)} SQL-запросов при бюджете {budget}:\n" + format_statements(statements)
+        )
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.statements.append(statement)
+
+
+def format_statements(statements: List[str], width: int = 200) -> str:
+    """Повторяющиеся запросы сворачиваются в одну строку с числом повторов — так видно N+1."""
+    lines = []
+    for statement, count in Counter(" ".join(s.split()) for s in statements).items():
+        text = statement if len(statement) <= width else statement[:width] + "..."
+        lines.append(f"  {count}x {text}" if count > 1 else f"  {text}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def query_budget(max_queries: int, engine=None):
+    """Проверяет, что за время блока к engine ушло не больше max_queries запросов.
+
+    Считаются запросы из всех потоков (TestClient выполняет приложение в своём),
+    поэтому помощник предназначен для тестов, а не для конкурентного сервера.
+    """
+    engine = engine if engine is not None else models.engine
+    recorder = QueryRecorder()
+    event.listen(engine, "before_cursor_execute", recorder.record)
+    try:
+        yield recorder
+    finally:
+        event.remove(engine, "before_cursor_execute", recorder.record)
+    if len(recorder) > max_queries:
+        raise QueryBudgetExceeded(max_queries, recorder.statements)
+
+
+# Запросы текущего HTTP-запроса для middleware; синхронные маршруты в пуле потоков
+# получают копию контекста и пишут в тот же объект
+_current: ContextVar[Optional[QueryRecorder]] = ContextVar("query_budget_recorder", default=None)
+
+
+def _record_current(conn, cursor, statement, parameters, context, executemany) -> None:
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.statements.append(statement)
+
+
+def install(engine) -> None:
+    """Подключает запись запросов для middleware (для AsyncEngine передаётся .sync_engine)."""
+    if not event.contains(engine, "before_cursor_execute", _record_current):
+        event.listen(engine, "before_cursor_execute", _record_current)
+
+
+async def query_budget_middleware(request: Request, call_next):
+    recorder = QueryRecorder()
+    token = _current.set(recorder)
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    if len(recorder) > QUERY_BUDGET:
+        route = getattr(request.scope.get("route"), "path", request.url.path)
+        print(
+            f"[Query Budget] {request.method} {route}: {len(recorder)} SQL-запросов при бюджете {QUERY_BUDGET}\n"
+            + format_statements(recorder.statements)
+        )
+    return response
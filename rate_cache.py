@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+
+# Курсы меняются не чаще раза в день, но другие воркеры могут записать их в БД,
+# поэтому таблица целиком перечитывается не реже, чем раз в RATE_CACHE_TTL секунд.
+RATE_CACHE_TTL = int(os.getenv("RATE_CACHE_TTL", "300"))
+# Сколько раз reload перечитывает таблицу, если во время запроса в неё писали
+RATE_RELOAD_ATTEMPTS = 3
+
+
+class RateTable:
+    """Таблица курсов в памяти процесса.
+
+    Для каждой пары валют хранятся два параллельных отсортированных массива:
+    порядковые номера дат (``array('l')``) и курсы (``array('d')``).
+    Поиск курса на дату — бинарный поиск по массиву дат.
+    """
+
+    def __init__(self, ttl: int = RATE_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Tuple[array, array]] = {}
+        self._loaded_at: Optional[float] = None
+        # Растёт при каждой записи (set, set_many, discard); по нему reload видит,
+        # что таблицу изменили, пока шёл запрос к БД
+        self._generation = 0
+
+    def ensure_loaded(self, db: Session) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return
+        self.reload(db)
+
+    def reload(self, db: Session) -> None:
+        # Запись делается после commit, поэтому всё, что записано до снимка поколения,
+        # запрос уже увидит. Если запись пришла во время запроса, результат может её
+        # не содержать — тогда он отбрасывается и таблица читается заново.
+        for _ in range(RATE_RELOAD_ATTEMPTS):
+            generation = self._generation
+            series = self._load(db)
+            with self._lock:
+                if self._generation == generation:
+                    self._series = series
+                    self._loaded_at = time.monotonic()
+                    return
+        # Таблица не успевает устояться: оставляем текущую (в ней все записи),
+        # _loaded_at не сдвигается, и следующий запрос попробует снова
+        print(f"[Rates] Таблица курсов менялась во время {RATE_RELOAD_ATTEMPTS} перезагрузок подряд, перезагрузка отложена")
+
+    def _load(self, db: Session) -> Dict[Tuple[str, str], Tuple[array, array]]:
+        rows = db.query(
+            models.ExchangeRate.from_currency,
+            models.ExchangeRate.to_currency,
+            models.ExchangeRate.rate_date,
+            models.ExchangeRate.rate
+        ).order_by(
+            models.ExchangeRate.from_currency,
+            models.ExchangeRate.to_currency,
+            models.ExchangeRate.rate_date
+        ).all()
+
+        series: Dict[Tuple[str, str], Tuple[array, array]] = {}
+        for from_currency, to_currency, rate_date, rate in rows:
+            if rate_date is None or rate is None:
+                continue
+            pair = series.get((from_currency, to_currency))
+            if pair is None:
+                pair = series[(from_currency, to_currency)] = (array("l"), array("d"))
+            pair[0].append(rate_date.toordinal())
+            pair[1].append(float(rate))
+        return series
+
+    def get(self, from_currency: str, to_currency: str, rate_date: date) -> Optional[float]:
+        pair = self._series.get((from_currency, to_currency))
+        if pair is None:
+            return None
+        dates, rates = pair
+        ordinal = rate_date.toordinal()
+        i = bisect_left(dates, ordinal)
+        if i < len(dates) and dates[i] == ordinal:
+            return rates[i]
+        return None
+
+    # Запись идёт по принципу copy-on-write: читатели работают без блокировки
+    # и всегда видят целую пару массивов, старую или новую.
+    def set(self, from_currency: str, to_currency: str, rate_date: date, rate: float) -> None:
+        ordinal = rate_date.toordinal()
+        with self._lock:
+            dates, rates = self._series.get((from_currency, to_currency), (array("l"), array("d")))
+            dates, rates = array("l", dates), array("d", rates)
+            i = bisect_left(dates, ordinal)
+            if i < len(dates) and dates[i] == ordinal:
+                rates[i] = float(rate)
+            else:
+                dates.insert(i, ordinal)
+                rates.insert(i, float(rate))
+            self._series[(from_currency, to_currency)] = (dates, rates)
+            self._generation += 1
+
+    def set_many(self, entries: Iterable[Tuple[str, str, date, float]]) -> None:
+        """Пакетная запись: каждая пара массивов пересобирается один раз."""
+        updates: Dict[Tuple[str, str], Dict[int, float]] = {}
+        for from_currency, to_currency, rate_date, rate in entries:
+            updates.setdefault((from_currency, to_currency), {})[rate_date.toordinal()] = float(rate)
+        with self._lock:
+            for pair, pair_updates in updates.items():
+                dates, rates = self._series.get(pair, (array("l"), array("d")))
+                merged = dict(zip(dates, rates))
+                merged.update(pair_updates)
+                ordinals = sorted(merged)
+                self._series[pair] = (array("l", ordinals), array("d", (merged[o] for o in ordinals)))
+            self._generation += 1
+
+    def discard(self, from_currency: str, to_currency: str, rate_date: date) -> None:
+        ordinal = rate_date.toordinal()
+        with self._lock:
+            pair = self._series.get((from_currency, to_currency))
+            if pair is None:
+                return
+            dates, rates = array("l", pair[0]), array("d", pair[1])
+            i = bisect_left(dates, ordinal)
+            if i < len(dates) and dates[i] == ordinal:
+                del dates[i]
+                del rates[i]
+                self._series[(from_currency, to_currency)] = (dates, rates)
+                self._generation += 1
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+
+rate_table = RateTable()
+
+
+def convert_value(value, currency_code: str, value_date: date, target_currency: str):
+    """Конвертирует значение по таблице курсов: (converted_value, warning)."""
+    if currency_code == target_currency:
+        return float(value), None
+    rate = rate_table.get(currency_code, target_currency, value_date)
+    if rate is not None:
+        return round(float(value) * rate, 2), None
+    return None, f"No exchange rate found for {currency_code} to {target_currency} on {value_date}"
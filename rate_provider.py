@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+EXCHANGE_API_URL = os.getenv("EXCHANGE_API_URL", "https://api.exchangerate.host")
+EXCHANGE_API_TIMEOUT = float(os.getenv("EXCHANGE_API_TIMEOUT", "5"))
+EXCHANGE_API_MAX_WORKERS = int(os.getenv("EXCHANGE_API_MAX_WORKERS", "8"))
+EXCHANGE_API_RPS = float(os.getenv("EXCHANGE_API_RPS", "5"))
+EXCHANGE_API_MAX_RETRIES = int(os.getenv("EXCHANGE_API_MAX_RETRIES", "3"))
+EXCHANGE_API_BACKOFF = float(os.getenv("EXCHANGE_API_BACKOFF", "0.5"))
+
+
+class RateLimiter:
+    """Ограничивает частоту запросов: не чаще requests_per_second во всех потоках."""
+
+    def __init__(self, requests_per_second: float):
+        self._interval = 1.0 / requests_per_second
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ExchangeRateClient:
+    """Клиент API курсов с пулом соединений, параллельной загрузкой и повторами.
+
+    base_url можно направить на локальный сервер, отдающий ответы
+    в формате exchangerate.host: ``GET /{YYYY-MM-DD}?base=RUB&symbols=USD,EUR``.
+    """
+
+    def __init__(
+        self,
+        base_url: str = EXCHANGE_API_URL,
+        timeout: float = EXCHANGE_API_TIMEOUT,
+        max_workers: int = EXCHANGE_API_MAX_WORKERS,
+        requests_per_second: float = EXCHANGE_API_RPS,
+        max_retries: int = EXCHANGE_API_MAX_RETRIES,
+        backoff: float = EXCHANGE_API_BACKOFF,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._limiter = RateLimiter(requests_per_second) if requests_per_second > 0 else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch_rates(
+        self,
+        rate_date: date,
+        base: str = "RUB",
+        symbols: Sequence[str] = ("USD", "EUR"),
+    ) -> Optional[Dict[str, float]]:
+        """Курсы base → symbols на дату или None, если все попытки не удались."""
+        url = f"{self.base_url}/{rate_date.isoformat()}?base={base}&symbols={','.join(symbols)}"
+        for attempt in range(self.max_retries):
+            if self._limiter:
+                self._limiter.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.ok:
+                    return response.json().get("rates", {})
+                print(f"[Rates API] {rate_date}: HTTP {response.status_code}, попытка {attempt + 1}/{self.max_retries}")
+            except (requests.RequestException, ValueError) as e:
+                print(f"[Rates API] {rate_date}: {e}, попытка {attempt + 1}/{self.max_retries}")
+            if attempt + 1 < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        return None
+
+    def fetch_many(
+        self,
+        dates: Iterable[date],
+        base: str = "RUB",
+        symbols: Sequence[str] = ("USD", "EUR"),
+    ) -> Dict[date, Optional[Dict[str, float]]]:
+        dates = list(dates)
+        if not dates:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(dates))) as pool:
+            results = pool.map(lambda d: self.fetch_rates(d, base, symbols), dates)
+            return dict(zip(dates, results))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: Optional[ExchangeRateClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ExchangeRateClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ExchangeRateClient()
+        return _client
@@ -0,0 +1,221 @@
+import os
+from datetime import date, datetime
+from itertools import permutations
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import and_, func, literal, literal_column, select, union
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import models
+from etags import bump_version
+from rate_cache import rate_table
+from rate_provider import get_client
+from rollups import refresh_rollups_for_dates
+
+BASE_CURRENCY = "RUB"
+# Валюты, курсы между которыми нужны на каждую дату значений показателей
+TRACKED_CURRENCIES = ("RUB", "USD", "EUR")
+UPSERT_BATCH_SIZE = 1000
+BACKFILL_CHUNK_DAYS = int(os.getenv("RATE_BACKFILL_CHUNK_DAYS", "31"))
+
+
+def build_rate_rows(rate_date: date, rates: Dict[str, float]) -> List[dict]:
+    """Строит все пары курсов на дату из ответа API с базой RUB.
+
+    RUB → X берётся как есть, X → RUB — обратный курс, X → Y — кросс-курс через RUB.
+    """
+    rows = []
+    for currency, rate in rates.items():
+        if not rate:
+            continue
+        rows.append({"from_currency": BASE_CURRENCY, "to_currency": currency, "rate": rate, "rate_date": rate_date})
+        rows.append({"from_currency": currency, "to_currency": BASE_CURRENCY, "rate": round(1 / rate, 6), "rate_date": rate_date})
+    for from_currency, to_currency in permutations([c for c, r in rates.items() if r], 2):
+        rows.append({
+            "from_currency": from_currency,
+            "to_currency": to_currency,
+            "rate": round(rates[to_currency] / rates[from_currency], 6),
+            "rate_date": rate_date
+        })
+    return rows
+
+
+def upsert_exchange_rates(db: Session, rows: List[dict]) -> Tuple[int, int, List[tuple]]:
+    """Записывает курсы многострочным INSERT ... ON CONFLICT DO UPDATE по uix_exchange_rate_date.
+
+    Существующий курс перезаписывается, только если отличается больше чем на 0.0001.
+    Возвращает (добавлено, обновлено, записанные строки); коммит остаётся за вызывающим.
+    """
+    # Одна и та же пара на дату не может встречаться в одном INSERT ... ON CONFLICT дважды
+    unique_rows = {(r["from_currency"], r["to_currency"], r["rate_date"]): r for r in rows}
+    rows = list(unique_rows.values())
+
+    inserted = updated = 0
+    written = []
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        stmt = pg_insert(models.ExchangeRate).values(rows[start:start + UPSERT_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uix_exchange_rate_date",
+            set_={"rate": stmt.excluded.rate},
+            where=func.abs(models.ExchangeRate.rate - stmt.excluded.rate) > 0.0001
+        ).returning(
+            models.ExchangeRate.from_currency,
+            models.ExchangeRate.to_currency,
+            models.ExchangeRate.rate_date,
+            models.ExchangeRate.rate,
+            # xmax = 0 только у только что вставленных строк
+            literal_column("xmax = 0")
+        )
+        for from_currency, to_currency, rate_date, rate, is_insert in db.execute(stmt):
+            written.append((from_currency, to_currency, rate_date, rate))
+            if is_insert:
+                inserted += 1
+            else:
+                updated += 1
+    return inserted, updated, written
+
+
+def find_missing_rate_pairs(db: Session) -> List[Tuple[str, str, date]]:
+    """Все недостающие пары (from, to, дата) одним запросом с анти-джойном.
+
+    На каждую дату значений показателей нужны курсы между всеми отслеживаемыми
+    валютами и валютами самих значений на эту дату.
+    """
+    value = models.IndicatorValue
+    present = value.value_date.is_not(None)
+    needed = union(
+        select(value.value_date.label("rate_date"), value.currency_code.label("currency")).where(
+            present, value.currency_code.is_not(None)
+        ),
+        *[
+            select(value.value_date, literal(currency)).where(present)
+            for currency in TRACKED_CURRENCIES
+        ]
+    ).cte("needed")
+    source, target = needed.alias("source"), needed.alias("target")
+
+    stmt = select(source.c.currency, target.c.currency, source.c.rate_date).select_from(
+        source.join(
+            target,
+            and_(source.c.rate_date == target.c.rate_date, source.c.currency != target.c.currency)
+        ).outerjoin(
+            models.ExchangeRate,
+            and_(
+                models.ExchangeRate.from_currency == source.c.currency,
+                models.ExchangeRate.to_currency == target.c.currency,
+                models.ExchangeRate.rate_date == source.c.rate_date
+            )
+        )
+    ).where(models.ExchangeRate.id.is_(None))
+    return [tuple(row) for row in db.execute(stmt).all()]
+
+
+def plan_missing_dates(pairs: Iterable[Tuple[str, str, date]]) -> Dict[date, Set[str]]:
+    """Группирует недостающие пары по датам: дата → валюты, которые нужно запросить к RUB."""
+    plan: Dict[date, Set[str]] = {}
+    for from_currency, to_currency, rate_date in pairs:
+        symbols = plan.setdefault(rate_date, set(TRACKED_CURRENCIES) - {BASE_CURRENCY})
+        symbols.update({from_currency, to_currency} - {BASE_CURRENCY})
+    return plan
+
+
+def plan_for_date(db: Session, rate_date: date) -> Dict[date, Set[str]]:
+    existing = set(db.execute(
+        select(models.ExchangeRate.from_currency, models.ExchangeRate.to_currency).where(
+            models.ExchangeRate.rate_date == rate_date
+        )
+    ).all())
+    missing = [
+        (from_currency, to_currency, rate_date)
+        for from_currency, to_currency in permutations(TRACKED_CURRENCIES, 2)
+        if (from_currency, to_currency) not in existing
+    ]
+    return plan_missing_dates(missing)
+
+
+def sync_rate_dates(db: Session, plan: Dict[date, Set[str]]) -> Tuple[int, int, List[date], List[tuple]]:
+    """Загружает курсы по плану и записывает их одним upsert.
+
+    Возвращает (добавлено, обновлено, неудачные даты, записанные строки). Коммит
+    остаётся за вызывающим, после него записанные строки передаются в rate_table.set_many().
+    """
+    rows = []
+    failed_dates = []
+    by_symbols: Dict[Tuple[str, ...], List[date]] = {}
+    for rate_date, symbols in plan.items():
+        by_symbols.setdefault(tuple(sorted(symbols)), []).append(rate_date)
+
+    client = get_client()
+    for symbols, dates in by_symbols.items():
+        for rate_date, rates in client.fetch_many(sorted(dates), base=BASE_CURRENCY, symbols=symbols).items():
+            if rates is None:
+                failed_dates.append(rate_date)
+                continue
+            rows.extend(build_rate_rows(rate_date, rates))
+
+    inserted, updated, written = upsert_exchange_rates(db, rows)
+    refresh_rollups_for_dates(db, {rate_date for _, _, rate_date, _ in written})
+    if written:
+        bump_version(db, "exchange_rates")
+    return inserted, updated, sorted(failed_dates), written
+
+
+def run_rate_backfill(db: Session, job_name: str = "rate_backfill", chunk_days: int = BACKFILL_CHUNK_DAYS) -> dict:
+    """Догружает все недостающие курсы по кускам диапазона дат с контрольной точкой.
+
+    Каждый кусок коммитится вместе с отметкой last_completed_date. Если предыдущий
+    запуск упал (status = running), работа продолжается с даты после отметки.
+    """
+    state = db.get(models.RateBackfillState, job_name)
+    if state is None:
+        state = models.RateBackfillState(job_name=job_name, status="done", updated_at=datetime.utcnow())
+        db.add(state)
+    resume_after = state.last_completed_date if state.status == "running" else None
+
+    plan = plan_missing_dates(find_missing_rate_pairs(db))
+    dates = sorted(d for d in plan if resume_after is None or d > resume_after)
+    if resume_after:
+        print(f"[Rate Backfill] Продолжаем после {resume_after}")
+    print(f"[Rate Backfill] Дат с недостающими курсами: {len(dates)}")
+
+    total_dates = len(dates)
+    inserted = updated = 0
+    failed_dates: List[date] = []
+    while dates:
+        chunk = [d for d in dates if (d - dates[0]).days < chunk_days]
+        dates = dates[len(chunk):]
+
+        chunk_inserted, chunk_updated, chunk_failed, written = sync_rate_dates(db, {d: plan[d] for d in chunk})
+        inserted += chunk_inserted
+        updated += chunk_updated
+        failed_dates.extend(chunk_failed)
+
+        state.status = "running"
+        state.last_completed_date = chunk[-1]
+        state.updated_at = datetime.utcnow()
+        db.commit()
+        rate_table.set_many(written)
+        print(f"[Rate Backfill] {chunk[0]} → {chunk[-1]}: добавлено {chunk_inserted}, обновлено {chunk_updated}")
+
+    state.status = "done"
+    state.updated_at = datetime.utcnow()
+    db.commit()
+    return {"dates": total_dates, "inserted": inserted, "updated": updated, "failed_dates": failed_dates}
+
+
+def sync_exchange_rates(db: Session) -> str:
+    """Полная синхронизация: курсы на сегодня и догрузка всех недостающих дат."""
+    today = date.today()
+    inserted, updated, failed_dates, written = sync_rate_dates(db, plan_for_date(db, today))
+    db.commit()
+    rate_table.set_many(written)
+    if failed_dates:
+        print(f"[Rate Sync] Не удалось загрузить курсы на {today}")
+
+    backfill = run_rate_backfill(db)
+    return (
+        f"Сегодня: добавлено {inserted}, обновлено {updated}; "
+        f"догрузка: {backfill['dates']} дат, добавлено {backfill['inserted']}, обновлено {backfill['updated']}, "
+        f"не удалось {len(failed_dates) + len(backfill['failed_dates'])}"
+    )
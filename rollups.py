@@ -0,0 +1,210 @@
+import zlib
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import Date, and_, case, cast, delete, func, insert, literal, select, text, true
+from sqlalchemy.orm import Session
+
+import models
+
+PERIOD_TYPES = ("month", "quarter")
+# Ключ advisory-блокировки «вся свёртка» (однопараметрическая форма, как в jobs.py)
+ROLLUP_LOCK_KEY = zlib.crc32(b"indicator_rollups")
+
+
+def period_start(day: date, period_type: str) -> date:
+    if period_type == "month":
+        return day.replace(day=1)
+    return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+
+
+def period_end(day: date, period_type: str) -> date:
+    start = period_start(day, period_type)
+    months = 1 if period_type == "month" else 3
+    year, month = divmod(start.month - 1 + months, 12)
+    return date(start.year + year, month + 1, 1) - timedelta(days=1)
+
+
+def period_label(start: date, period_type: str) -> str:
+    if period_type == "month":
+        return start.strftime("%Y-%m")
+    return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+
+
+def covers_range(from_date: Optional[date], to_date: Optional[date], period_type: str) -> bool:
+    """Можно ли ответить на запрос за [from_date, to_date] целыми периодами из свёртки."""
+    if from_date and from_date != period_start(from_date, period_type):
+        return False
+    if to_date and to_date != period_end(to_date, period_type):
+        return False
+    return True
+
+
+def refresh_rollups(
+    db: Session,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    enterprise_ids: Optional[Iterable[int]] = None,
+    indicator_ids: Optional[Iterable[int]] = None,
+    currency_codes: Optional[Iterable[str]] = None,
+) -> None:
+    """Пересчитывает строки свёртки для всех периодов, затронутых диапазоном дат.
+
+    Пересчёт идёт целыми группами (предприятие × показатель × период) запросом
+    INSERT ... SELECT, поэтому его стоимость пропорциональна числу значений
+    в затронутых периодах, а не во всей таблице. currency_codes ограничивает
+    пересчёт целевыми валютами (например, только что добавленной). Коммит
+    остаётся за вызывающим.
+    """
+    db.flush()
+    enterprise_ids = list(enterprise_ids) if enterprise_ids is not None else None
+    indicator_ids = list(indicator_ids) if indicator_ids is not None else None
+    currency_codes = list(currency_codes) if currency_codes is not None else None
+    _lock_groups(db, enterprise_ids, indicator_ids)
+
+    for period_type in PERIOD_TYPES:
+        lower = period_start(date_from, period_type) if date_from else None
+        upper = period_start(date_to, period_type) if date_to else None
+
+        stale = delete(models.IndicatorRollup).where(models.IndicatorRollup.period_type == period_type)
+        if lower:
+            stale = stale.where(models.IndicatorRollup.period_start >= lower)
+        if upper:
+            stale = stale.where(models.IndicatorRollup.period_start <= upper)
+        if enterprise_ids is not None:
+            stale = stale.where(models.IndicatorRollup.enterprise_id.in_(enterprise_ids))
+        if indicator_ids is not None:
+            stale = stale.where(models.IndicatorRollup.indicator_id.in_(indicator_ids))
+        if currency_codes is not None:
+            stale = stale.where(models.IndicatorRollup.currency_code.in_(currency_codes))
+        db.execute(stale, execution_options={"synchronize_session": False})
+
+        db.execute(_rollup_insert(period_type, lower, upper, enterprise_ids, indicator_ids, currency_codes))
+
+
+def _lock_groups(db: Session, enterprise_ids, indicator_ids) -> None:
+    """Сериализует пересчёт одних и тех же групп в параллельных транзакциях.
+
+    Без блокировки вторая из двух записей в одну группу падает на uix_indicator_rollup
+    (а ON CONFLICT записал бы суммы по снимку без значения первой). Пары предприятие ×
+    показатель блокируются по возрастанию под разделяемой блокировкой всей свёртки;
+    пересчёт без списка пар (курсы, новая валюта) берёт её исключительно. Блокировки
+    снимаются при commit/rollback.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    if enterprise_ids is None or indicator_ids is None:
+        db.execute(select(func.pg_advisory_xact_lock(ROLLUP_LOCK_KEY)))
+        return
+    db.execute(select(func.pg_advisory_xact_lock_shared(ROLLUP_LOCK_KEY)))
+    db.execute(text("""
+        SELECT pg_advisory_xact_lock(pairs.enterprise_id, pairs.indicator_id)
+        FROM (
+            SELECT e AS enterprise_id, i AS indicator_id
+            FROM unnest(CAST(:enterprise_ids AS integer[])) AS e
+            CROSS JOIN unnest(CAST(:indicator_ids AS integer[])) AS i
+            ORDER BY e, i
+        ) AS pairs
+    """), {"enterprise_ids": sorted(set(enterprise_ids)), "indicator_ids": sorted(set(indicator_ids))})
+
+
+def refresh_rollups_for_dates(db: Session, dates: Iterable[date]) -> None:
+    """Пересчитывает свёртку после изменения курсов на указанные даты (по кварталу за раз)."""
+    for start in sorted({period_start(day, "quarter") for day in dates}):
+        refresh_rollups(db, start, period_end(start, "quarter"))
+
+
+def _rollup_insert(period_type, lower, upper, enterprise_ids, indicator_ids, currency_codes=None):
+    value = models.IndicatorValue
+    bucket = cast(func.date_trunc(period_type, value.value_date), Date)
+    same_currency = value.currency_code == models.Currency.code
+
+    stmt = select(
+        value.enterprise_id,
+        value.indicator_id,
+        literal(period_type),
+        bucket,
+        models.Currency.code,
+        func.sum(case((same_currency, value.value), else_=value.value * models.ExchangeRate.rate)),
+        func.count(value.id),
+        func.sum(case((and_(~same_currency, models.ExchangeRate.rate.is_(None)), 1), else_=0)),
+    ).select_from(value).join(
+        models.Currency, true()
+    ).outerjoin(
+        models.ExchangeRate,
+        and_(
+            models.ExchangeRate.from_currency == value.currency_code,
+            models.ExchangeRate.to_currency == models.Currency.code,
+            models.ExchangeRate.rate_date == value.value_date
+        )
+    ).where(
+        value.enterprise_id.is_not(None),
+        value.indicator_id.is_not(None),
+        value.value_date.is_not(None)
+    )
+    if lower:
+        stmt = stmt.where(value.value_date >= lower)
+    if upper:
+        stmt = stmt.where(value.value_date <= period_end(upper, period_type))
+    if enterprise_ids is not None:
+        stmt = stmt.where(value.enterprise_id.in_(enterprise_ids))
+    if indicator_ids is not None:
+        stmt = stmt.where(value.indicator_id.in_(indicator_ids))
+    if currency_codes is not None:
+        stmt = stmt.where(models.Currency.code.in_(currency_codes))
+    stmt = stmt.group_by(value.enterprise_id, value.indicator_id, bucket, models.Currency.code)
+
+    return insert(models.IndicatorRollup).from_select(
+        [
+            "enterprise_id", "indicator_id", "period_type", "period_start", "currency_code",
+            "total_value", "value_count", "missing_rate_count",
+        ],
+        stmt
+    )
+
+
+def grouped_totals_stmt(
+    enterprise_id: int,
+    period_type: str,
+    target_currency: str,
+    indicator_id: Optional[int] = None,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+):
+    rollup = models.IndicatorRollup
+    stmt = select(
+        rollup.period_start,
+        func.sum(rollup.total_value * models.Indicator.importance),
+        func.sum(rollup.missing_rate_count)
+    ).join(
+        models.Indicator, rollup.indicator_id == models.Indicator.id
+    ).where(
+        rollup.enterprise_id == enterprise_id,
+        rollup.period_type == period_type,
+        rollup.currency_code == target_currency
+    )
+    if indicator_id:
+        stmt = stmt.where(rollup.indicator_id == indicator_id)
+    if from_date:
+        stmt = stmt.where(rollup.period_start >= from_date)
+    if to_date:
+        stmt = stmt.where(rollup.period_start <= to_date)
+    return stmt.group_by(rollup.period_start).order_by(rollup.period_start)
+
+
+def label_grouped_totals(rows, period_type: str):
+    return [(period_label(start, period_type), total, missing) for start, total, missing in rows]
+
+
+def grouped_totals(
+    db: Session,
+    enterprise_id: int,
+    period_type: str,
+    target_currency: str,
+    indicator_id: Optional[int] = None,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None,
+):
+    """Взвешенные суммы по периодам из свёртки: (метка периода, сумма, число значений без курса)."""
+    stmt = grouped_totals_stmt(enterprise_id, period_type, target_currency, indicator_id, from_date, to_date)
+    return label_grouped_totals(db.execute(stmt).all(), period_type)
@@ -1,39 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List
 from datetime import timedelta, date
+from decimal import Decimal
 from passlib.exc import UnknownHashError
 import models
 import schemas
-from dependencies import get_db, get_current_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, pwd_context, create_refresh_token
-from sqlalchemy.sql import func
+from rate_cache import rate_table, convert_value
+from rollups import refresh_rollups, covers_range, grouped_totals
+from rate_sync import plan_for_date, sync_rate_dates, run_rate_backfill
+from pagination import next_cursor_headers
+from hashing import hash_password, verify_password
+from etags import bump_version, not_modified, check_etag, get_version
+from enterprise_search import search_enterprises
+from avatar_storage import ALLOWED_AVATAR_TYPES, get_avatar_storage
+from serializers import (
+    serialize_indicator_values, serialize_indicator_value_rows, parse_fields, objects_by_id,
+    weighted_groups, weighted_aggregate, weighted_rows
+)
+from queries import (
+    indicator_value_filters, indicator_values_stmt, indicator_value_rows_stmt, needs_conversion,
+    paginate_indicator_values, enterprises_stmt, indicators_stmt,
+    weighted_filters, weighted_totals_stmt, weighted_rows_stmt
+)
+from dependencies import get_db, get_current_user, get_current_principal, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, create_refresh_token
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 import os
+import io
+import csv
+import json
 import uuid
 from pathlib import Path
 import shutil
 from fastapi import Query, Depends
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import Session
-from typing import List, Dict, Optional
+from typing import List, Optional
 from datetime import date
 router = APIRouter()
 
+def _save_new(db: Session, obj) -> None:
+    db.add(obj)
+    db.commit()
+    db.refresh(obj)
+
 @router.post("/register", response_model=schemas.TokenPair, tags=["auth"], summary="Register a new user")
-def register_user(user: schemas.UserCreateSchema, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreateSchema, db: Session = Depends(get_db)):
     # Проверяем, существует ли уже пользователь с таким username
-    existing_user = db.query(models.User).filter(models.User.username == user.username).first()
+    existing_user = await run_in_threadpool(
+        db.query(models.User).filter(models.User.username == user.username).first
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    # Хэшируем пароль
-    hashed_password = pwd_context.hash(user.password)
+    # Хэшируем пароль в отдельном пуле процессов
+    hashed_password = await hash_password(user.password)
     
     # Создаём нового пользователя
     db_user = models.User(username=user.username, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await run_in_threadpool(_save_new, db, db_user)
     
     # Генерируем токены
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -50,11 +80,13 @@ def register_user(user: schemas.UserCreateSchema, db: Session = Depends(get_db))
     }
 
 @router.post("/token", response_model=schemas.TokenPair, tags=["auth"], summary="Вход и получение токена доступа")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: Session = Depends(get_db)
 ):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    user = await run_in_threadpool(
+        db.query(models.User).filter(models.User.username == form_data.username).first
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -62,7 +94,7 @@ def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     try:
-        if not pwd_context.verify(form_data.password, user.hashed_password):
+        if not await verify_password(form_data.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Неверный пароль",
@@ -121,84 +153,93 @@ def update_current_user(
     db.refresh(current_user)
     return current_user
 
+def _set_avatar_url(db: Session, principal, avatar_url: str):
+    user = principal.user
+    previous = user.avatar_url
+    user.avatar_url = avatar_url
+    db.commit()
+    db.refresh(user)
+    return user, previous
+
 @router.post("/users/me/avatar", response_model=schemas.UserSchema, tags=["users"], summary="Upload user avatar")
 async def upload_user_avatar(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    principal=Depends(get_current_principal)
 ):
-    import cloudinary
-    import cloudinary.uploader
-    from dotenv import load_dotenv
-    import os
-
-    load_dotenv()
-
     # Проверка MIME-типа файла
-    allowed_types = ["image/jpeg", "image/png"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_AVATAR_TYPES:
         raise HTTPException(status_code=400, detail="Only JPEG or PNG images are allowed")
 
-    # Проверка размера файла (до 5 МБ)
-    max_size = 5 * 1024 * 1024  # 5 MB
-    content = await file.read()
-    if len(content) > max_size:
-        raise HTTPException(status_code=400, detail="File size exceeds 5 MB")
-
-    # Cloudinary config
-    cloudinary.config(
-        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-        api_key=os.getenv("CLOUDINARY_API_KEY"),
-        api_secret=os.getenv("CLOUDINARY_API_SECRET")
-    )
-
-    # Загрузка в Cloudinary (из памяти)
-    result = cloudinary.uploader.upload(
-        content,
-        folder="avatars",
-        resource_type="image"
-    )
-
-    # Сохранение URL в базу
-    current_user.avatar_url = result["secure_url"]
-    db.commit()
-    db.refresh(current_user)
-
-    return current_user
+    # Размер проверяется по ходу копирования (до AVATAR_MAX_BYTES, по умолчанию 5 МБ);
+    # запись в хранилище и работа с сессией идут в пуле потоков, не в event loop
+    storage = get_avatar_storage()
+    avatar_url = await storage.save(file, principal.id)
+    try:
+        user, previous = await run_in_threadpool(_set_avatar_url, db, principal, avatar_url)
+    except Exception:
+        await storage.delete(avatar_url, principal.id)
+        raise
+    if previous and previous != avatar_url:
+        await storage.delete(previous, principal.id)
+    return user
 
 # -----------------------------------
 # Маршруты для предприятий
 # -----------------------------------
 
 @router.get("/enterprises/", response_model=List[schemas.EnterpriseSchema], tags=["enterprises"], summary="Get all enterprises")
-def get_enterprises(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_enterprises(request: Request, response: Response, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
+    cached = not_modified(request, response, db, "enterprises")
+    if cached:
+        return cached
     return db.query(models.Enterprise).all()
 
+@router.get("/enterprises/search", response_model=List[schemas.EnterpriseSchema], tags=["enterprises"], summary="Search enterprises by name")
+def search_enterprises_by_name(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Начало или часть названия"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    principal=Depends(get_current_principal)
+):
+    # Автодополнение: сначала названия, начинающиеся с q, затем похожие (триграммы)
+    version = get_version(db, "enterprises")
+    cached = check_etag(request, response, "enterprises", version)
+    if cached:
+        return cached
+    return search_enterprises(db, q.strip(), skip, limit, version)
+
 @router.post("/enterprises/", response_model=schemas.EnterpriseSchema, tags=["enterprises"], summary="Create a new enterprise")
-def create_enterprise(enterprise: schemas.EnterpriseCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def create_enterprise(enterprise: schemas.EnterpriseCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_enterprise = models.Enterprise(**enterprise.dict())
     db.add(db_enterprise)
+    bump_version(db, "enterprises")
     db.commit()
     db.refresh(db_enterprise)
     return db_enterprise
 
 @router.put("/enterprises/{id}", response_model=schemas.EnterpriseSchema, tags=["enterprises"], summary="Update an enterprise")
-def update_enterprise(id: int, enterprise: schemas.EnterpriseCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def update_enterprise(id: int, enterprise: schemas.EnterpriseCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_enterprise = db.query(models.Enterprise).filter(models.Enterprise.id == id).first()
     if not db_enterprise:
         raise HTTPException(status_code=404, detail="Enterprise not found")
     for key, value in enterprise.dict().items():
         setattr(db_enterprise, key, value)
+    bump_version(db, "enterprises")
     db.commit()
     db.refresh(db_enterprise)
     return db_enterprise
 
 @router.delete("/enterprises/{id}", tags=["enterprises"], summary="Delete an enterprise")
-def delete_enterprise(id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def delete_enterprise(id: int, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_enterprise = db.query(models.Enterprise).filter(models.Enterprise.id == id).first()
     if not db_enterprise:
         raise HTTPException(status_code=404, detail="Enterprise not found")
     db.delete(db_enterprise)
+    bump_version(db, "enterprises")
     db.commit()
     return {"detail": "Enterprise deleted"}
 
@@ -207,34 +248,40 @@ def delete_enterprise(id: int, db: Session = Depends(get_db), current_user=Depen
 # -----------------------------------
 
 @router.get("/indicators/", response_model=List[schemas.IndicatorSchema], tags=["indicators"], summary="Get all indicators")
-def get_indicators(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_indicators(request: Request, response: Response, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
+    cached = not_modified(request, response, db, "indicators")
+    if cached:
+        return cached
     return db.query(models.Indicator).all()
 
 @router.post("/indicators/", response_model=schemas.IndicatorSchema, tags=["indicators"], summary="Create a new indicator")
-def create_indicator(indicator: schemas.IndicatorCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def create_indicator(indicator: schemas.IndicatorCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_indicator = models.Indicator(**indicator.dict())
     db.add(db_indicator)
+    bump_version(db, "indicators")
     db.commit()
     db.refresh(db_indicator)
     return db_indicator
 
 @router.put("/indicators/{id}", response_model=schemas.IndicatorSchema, tags=["indicators"], summary="Update an indicator")
-def update_indicator(id: int, indicator: schemas.IndicatorCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def update_indicator(id: int, indicator: schemas.IndicatorCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_indicator = db.query(models.Indicator).filter(models.Indicator.id == id).first()
     if not db_indicator:
         raise HTTPException(status_code=404, detail="Indicator not found")
     for key, value in indicator.dict().items():
         setattr(db_indicator, key, value)
+    bump_version(db, "indicators")
     db.commit()
     db.refresh(db_indicator)
     return db_indicator
 
 @router.delete("/indicators/{id}", tags=["indicators"], summary="Delete an indicator")
-def delete_indicator(id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def delete_indicator(id: int, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_indicator = db.query(models.Indicator).filter(models.Indicator.id == id).first()
     if not db_indicator:
         raise HTTPException(status_code=404, detail="Indicator not found")
     db.delete(db_indicator)
+    bump_version(db, "indicators")
     db.commit()
     return {"detail": "Indicator deleted"}
 
@@ -243,34 +290,42 @@ def delete_indicator(id: int, db: Session = Depends(get_db), current_user=Depend
 # -----------------------------------
 
 @router.get("/currencies/", response_model=List[schemas.CurrencySchema], tags=["currencies"], summary="Get all currencies")
-def get_currencies(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_currencies(request: Request, response: Response, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
+    cached = not_modified(request, response, db, "currencies")
+    if cached:
+        return cached
     return db.query(models.Currency).all()
 
 @router.post("/currencies/", response_model=schemas.CurrencySchema, tags=["currencies"], summary="Create a new currency")
-def create_currency(currency: schemas.CurrencyCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def create_currency(currency: schemas.CurrencyCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_currency = models.Currency(**currency.dict())
     db.add(db_currency)
+    # Новая валюта становится ещё одной целевой валютой свёртки: строятся только её строки
+    refresh_rollups(db, currency_codes=[db_currency.code])
+    bump_version(db, "currencies")
     db.commit()
     db.refresh(db_currency)
     return db_currency
 
 @router.put("/currencies/{code}", response_model=schemas.CurrencySchema, tags=["currencies"], summary="Update a currency")
-def update_currency(code: str, currency: schemas.CurrencyCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def update_currency(code: str, currency: schemas.CurrencyCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_currency = db.query(models.Currency).filter(models.Currency.code == code).first()
     if not db_currency:
         raise HTTPException(status_code=404, detail="Currency not found")
     for key, value in currency.dict().items():
         setattr(db_currency, key, value)
+    bump_version(db, "currencies")
     db.commit()
     db.refresh(db_currency)
     return db_currency
 
 @router.delete("/currencies/{code}", tags=["currencies"], summary="Delete a currency")
-def delete_currency(code: str, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def delete_currency(code: str, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_currency = db.query(models.Currency).filter(models.Currency.code == code).first()
     if not db_currency:
         raise HTTPException(status_code=404, detail="Currency not found")
     db.delete(db_currency)
+    bump_version(db, "currencies")
     db.commit()
     return {"detail": "Currency deleted"}
 
@@ -279,35 +334,50 @@ def delete_currency(code: str, db: Session = Depends(get_db), current_user=Depen
 # -----------------------------------
 
 @router.get("/exchange-rates/", response_model=List[schemas.ExchangeRateSchema], tags=["exchange_rates"], summary="Get all exchange rates")
-def get_exchange_rates(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def get_exchange_rates(request: Request, response: Response, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
+    cached = not_modified(request, response, db, "exchange_rates")
+    if cached:
+        return cached
     return db.query(models.ExchangeRate).all()
 
 @router.post("/exchange-rates/", response_model=schemas.ExchangeRateSchema, tags=["exchange_rates"], summary="Create a new exchange rate")
-def create_exchange_rate(exchange_rate: schemas.ExchangeRateCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def create_exchange_rate(exchange_rate: schemas.ExchangeRateCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_exchange_rate = models.ExchangeRate(**exchange_rate.dict())
     db.add(db_exchange_rate)
+    refresh_rollups(db, db_exchange_rate.rate_date, db_exchange_rate.rate_date)
+    bump_version(db, "exchange_rates")
     db.commit()
     db.refresh(db_exchange_rate)
+    rate_table.set(db_exchange_rate.from_currency, db_exchange_rate.to_currency, db_exchange_rate.rate_date, db_exchange_rate.rate)
     return db_exchange_rate
 
 @router.put("/exchange-rates/{id}", response_model=schemas.ExchangeRateSchema, tags=["exchange_rates"], summary="Update an exchange rate")
-def update_exchange_rate(id: int, exchange_rate: schemas.ExchangeRateCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def update_exchange_rate(id: int, exchange_rate: schemas.ExchangeRateCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_exchange_rate = db.query(models.ExchangeRate).filter(models.ExchangeRate.id == id).first()
     if not db_exchange_rate:
         raise HTTPException(status_code=404, detail="Exchange rate not found")
+    old_key = (db_exchange_rate.from_currency, db_exchange_rate.to_currency, db_exchange_rate.rate_date)
     for key, value in exchange_rate.dict().items():
         setattr(db_exchange_rate, key, value)
+    for rate_date in {old_key[2], db_exchange_rate.rate_date}:
+        refresh_rollups(db, rate_date, rate_date)
+    bump_version(db, "exchange_rates")
     db.commit()
     db.refresh(db_exchange_rate)
+    rate_table.discard(*old_key)
+    rate_table.set(db_exchange_rate.from_currency, db_exchange_rate.to_currency, db_exchange_rate.rate_date, db_exchange_rate.rate)
     return db_exchange_rate
 
 @router.delete("/exchange-rates/{id}", tags=["exchange_rates"], summary="Delete an exchange rate")
-def delete_exchange_rate(id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def delete_exchange_rate(id: int, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_exchange_rate = db.query(models.ExchangeRate).filter(models.ExchangeRate.id == id).first()
     if not db_exchange_rate:
         raise HTTPException(status_code=404, detail="Exchange rate not found")
     db.delete(db_exchange_rate)
+    refresh_rollups(db, db_exchange_rate.rate_date, db_exchange_rate.rate_date)
+    bump_version(db, "exchange_rates")
     db.commit()
+    rate_table.discard(db_exchange_rate.from_currency, db_exchange_rate.to_currency, db_exchange_rate.rate_date)
     return {"detail": "Exchange rate deleted"}
 
 @router.get(
@@ -326,69 +396,132 @@ def get_indicator_values(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     enterprise_name: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Значение заголовка X-Next-Cursor предыдущей страницы"),
+    fields: Optional[str] = Query(None, description="Список полей через запятую, например value_date,value,converted_value"),
+    shape: str = Query("nested", pattern="^(nested|flat)$", description="flat — enterprise_id/indicator_id вместо вложенных объектов"),
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    principal=Depends(get_current_principal)
 ) -> List[schemas.IndicatorValueWithObjects]:
-    query = db.query(models.IndicatorValue).options(
-        selectinload(models.IndicatorValue.enterprise),
-        selectinload(models.IndicatorValue.indicator)
+    if cursor and skip:
+        raise HTTPException(status_code=400, detail="skip cannot be combined with cursor")
+    selected_fields = parse_fields(fields, shape)
+    filters = indicator_value_filters(
+        enterprise_id, indicator_id, from_date, to_date, currency_code, enterprise_name
     )
 
-    if enterprise_name:
-        query = query.join(models.Enterprise).filter(models.Enterprise.name == enterprise_name)
-    elif enterprise_id:
-        query = query.filter(models.IndicatorValue.enterprise_id == enterprise_id)
-
-    if indicator_id:
-        query = query.filter(models.IndicatorValue.indicator_id == indicator_id)
-    if from_date:
-        query = query.filter(models.IndicatorValue.value_date >= from_date)
-    if to_date:
-        query = query.filter(models.IndicatorValue.value_date <= to_date)
-    if currency_code:
-        query = query.filter(models.IndicatorValue.currency_code == currency_code)
-
-    query = query.offset(skip).limit(limit)
-    indicator_values = query.all()
-
-    dates = {item.value_date for item in indicator_values}
-    currencies = {item.currency_code for item in indicator_values}
-
-    exchange_rates = db.query(models.ExchangeRate).filter(
-        models.ExchangeRate.from_currency.in_(currencies),
-        models.ExchangeRate.to_currency == target_currency,
-        models.ExchangeRate.rate_date.in_(dates)
-    ).all()
-
-    rate_dict: Dict[tuple, float] = {
-        (rate.from_currency, rate.rate_date): float(rate.rate)
-        for rate in exchange_rates
-    }
+    if shape == "nested" and fields is None:
+        stmt = paginate_indicator_values(indicator_values_stmt(filters), cursor, skip, limit)
+        indicator_values = db.execute(stmt).scalars().all()
+        rate_table.ensure_loaded(db)
+        content = serialize_indicator_values(indicator_values, target_currency)
+    else:
+        # Облегчённый путь: Core select() только нужных столбцов, без ORM-сущностей
+        stmt = paginate_indicator_values(indicator_value_rows_stmt(filters, selected_fields), cursor, skip, limit)
+        indicator_values = db.execute(stmt).all()
+        enterprises = indicators = None
+        if "enterprise" in selected_fields:
+            enterprises = objects_by_id(
+                db.execute(enterprises_stmt(row.enterprise_id for row in indicator_values)), schemas.EnterpriseSchema
+            )
+        if "indicator" in selected_fields:
+            indicators = objects_by_id(
+                db.execute(indicators_stmt(row.indicator_id for row in indicator_values)), schemas.IndicatorSchema
+            )
+        if needs_conversion(selected_fields):
+            rate_table.ensure_loaded(db)
+        content = serialize_indicator_value_rows(
+            indicator_values, selected_fields, target_currency, enterprises, indicators
+        )
 
-    result = []
-    for item in indicator_values:
-        if not item.enterprise or not item.indicator:
-            continue
+    # Ответ сериализуется сразу в байты: response_model остаётся только для документации
+    return Response(
+        content=content,
+        media_type="application/json",
+        headers=next_cursor_headers(indicator_values, limit)
+    )
 
-        base = schemas.IndicatorValueWithObjects.from_orm(item).dict()
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_COLUMNS = [
+    "id", "enterprise_id", "enterprise_name", "indicator_id", "indicator_name",
+    "value_date", "value", "currency_code", "converted_value", "warning"
+]
 
-        if item.currency_code == target_currency:
-            base["converted_value"] = float(item.value)
-            base["warning"] = None
-        else:
-            rate_key = (item.currency_code, item.value_date)
-            if rate_key in rate_dict:
-                base["converted_value"] = round(float(item.value) * rate_dict[rate_key], 2)
-                base["warning"] = None
-            else:
-                base["converted_value"] = None
-                base["warning"] = (
-                    f"No exchange rate found for {item.currency_code} to {target_currency} on {item.value_date}"
-                )
 
-        result.append(schemas.IndicatorValueWithObjects(**base))
+@router.get(
+    "/indicator-values/export",
+    tags=["indicator_values"],
+    summary="Export indicator values as NDJSON or CSV",
+    response_class=StreamingResponse
+)
+def export_indicator_values(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    enterprise_id: int = Query(None),
+    indicator_id: int = Query(None),
+    from_date: date = Query(None),
+    to_date: date = Query(None),
+    target_currency: str = Query("RUB"),
+    currency_code: str = Query(None),
+    enterprise_name: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    principal=Depends(get_current_principal)
+):
+    rate_table.ensure_loaded(db)
+    stmt = select(
+        models.IndicatorValue.id,
+        models.IndicatorValue.enterprise_id,
+        models.Enterprise.name,
+        models.IndicatorValue.indicator_id,
+        models.Indicator.name,
+        models.IndicatorValue.value_date,
+        models.IndicatorValue.value,
+        models.IndicatorValue.currency_code
+    ).join(
+        models.Enterprise, models.IndicatorValue.enterprise_id == models.Enterprise.id
+    ).join(
+        models.Indicator, models.IndicatorValue.indicator_id == models.Indicator.id
+    ).where(*indicator_value_filters(
+        enterprise_id, indicator_id, from_date, to_date, currency_code, enterprise_name
+    )).order_by(models.IndicatorValue.value_date, models.IndicatorValue.id)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(
+        _stream_export(stmt, format, target_currency),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="indicator_values.{format}"'}
+    )
+
+
+def _stream_export(stmt, format: str, target_currency: str):
+    # Сессия зависимости get_db закрывается до отправки тела ответа,
+    # поэтому генератор открывает собственную. yield_per включает серверный курсор.
+    db = models.SessionLocal()
+    try:
+        if format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for rows in result.partitions():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer) if format == "csv" else None
+            for id, enterprise_id, enterprise_name, indicator_id, indicator_name, value_date, value, currency in rows:
+                converted_value, warning = convert_value(value, currency, value_date, target_currency)
+                row = [
+                    id, enterprise_id, enterprise_name, indicator_id, indicator_name,
+                    value_date.isoformat() if value_date else None,
+                    float(value) if value is not None else None,
+                    currency, converted_value, warning
+                ]
+                if writer:
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+    finally:
+        db.close()
 
-    return result
 
 @router.post(
     "/indicator-values/", 
@@ -400,56 +533,153 @@ def get_indicator_values(
 def create_indicator_value(
     indicator_value: schemas.IndicatorValueCreateSchema,
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    principal=Depends(get_current_principal)
 ):
-    enterprise = db.query(models.Enterprise).get(indicator_value.enterprise_id)
-    if not enterprise:
+    # Проверка ссылок одним запросом
+    enterprise_exists, indicator_exists, currency_exists = db.execute(select(
+        select(models.Enterprise.id).where(models.Enterprise.id == indicator_value.enterprise_id).exists(),
+        select(models.Indicator.id).where(models.Indicator.id == indicator_value.indicator_id).exists(),
+        select(models.Currency.code).where(models.Currency.code == indicator_value.currency_code).exists()
+    )).one()
+    if not enterprise_exists:
         raise HTTPException(status_code=400, detail="Предприятие не найдено")
-
-    indicator = db.query(models.Indicator).get(indicator_value.indicator_id)
-    if not indicator:
+    if not indicator_exists:
         raise HTTPException(status_code=400, detail="Показатель не найден")
-
-    currency = db.query(models.Currency).get(indicator_value.currency_code)
-    if not currency:
+    if not currency_exists:
         raise HTTPException(status_code=400, detail="Валюта не найдена")
 
-    # Проверка на дубликат
-    existing = db.query(models.IndicatorValue).filter_by(
-        enterprise_id=indicator_value.enterprise_id,
-        indicator_id=indicator_value.indicator_id,
-        value_date=indicator_value.value_date,
-        value=indicator_value.value,
-        currency_code=indicator_value.currency_code
-    ).first()
-
-    if existing:
+    # Дубликат отсекает ограничение uix_indicator_value: вставка без отдельной проверки и без гонки
+    new_id = db.execute(
+        pg_insert(models.IndicatorValue)
+        .values(**indicator_value.dict())
+        .on_conflict_do_nothing(constraint="uix_indicator_value")
+        .returning(models.IndicatorValue.id)
+    ).scalar()
+    if new_id is None:
         raise HTTPException(status_code=409, detail="Такое значение уже существует")
 
-    db_value = models.IndicatorValue(**indicator_value.dict())
-    db.add(db_value)
+    refresh_rollups(db, indicator_value.value_date, indicator_value.value_date, [indicator_value.enterprise_id], [indicator_value.indicator_id])
     db.commit()
-    db.refresh(db_value)
-    return db_value
+    return models.IndicatorValue(id=new_id, **indicator_value.dict())
+
+
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+
+@router.post(
+    "/indicator-values/bulk",
+    response_model=schemas.IndicatorValueBulkResultSchema,
+    tags=["indicator_values"],
+    summary="Массовая загрузка значений показателей",
+    description="Проверяет ссылки для всего пакета разом и сохраняет новые значения одной транзакцией, "
+                "пропуская дубликаты по ограничению uix_indicator_value. "
+                "Возвращает статус каждой строки: created, duplicate или error."
+)
+def create_indicator_values_bulk(
+    indicator_values: List[schemas.IndicatorValueCreateSchema],
+    db: Session = Depends(get_db),
+    principal=Depends(get_current_principal)
+):
+    if len(indicator_values) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Не более {BULK_MAX_ITEMS} значений за один запрос")
+
+    # Проверка внешних ключей: по одному запросу на таблицу для всего пакета
+    enterprise_ids = {item.enterprise_id for item in indicator_values}
+    indicator_ids = {item.indicator_id for item in indicator_values}
+    currency_codes = {item.currency_code for item in indicator_values}
+    known_enterprises = set(db.scalars(select(models.Enterprise.id).where(models.Enterprise.id.in_(enterprise_ids))))
+    known_indicators = set(db.scalars(select(models.Indicator.id).where(models.Indicator.id.in_(indicator_ids))))
+    known_currencies = set(db.scalars(select(models.Currency.code).where(models.Currency.code.in_(currency_codes))))
+
+    results: List[Optional[dict]] = [None] * len(indicator_values)
+    candidates = {}
+    for index, item in enumerate(indicator_values):
+        if item.enterprise_id not in known_enterprises:
+            results[index] = {"index": index, "status": "error", "detail": "Предприятие не найдено"}
+        elif item.indicator_id not in known_indicators:
+            results[index] = {"index": index, "status": "error", "detail": "Показатель не найден"}
+        elif item.currency_code not in known_currencies:
+            results[index] = {"index": index, "status": "error", "detail": "Валюта не найдена"}
+        else:
+            key = _duplicate_key(item.enterprise_id, item.indicator_id, item.value_date, item.value, item.currency_code)
+            if key in candidates:
+                results[index] = {"index": index, "status": "duplicate", "detail": "Повтор внутри пакета"}
+            else:
+                candidates[key] = index
+
+    # Дубликаты в БД отсекает ограничение uix_indicator_value: строки, не вернувшиеся из RETURNING, уже были
+    if candidates:
+        inserted = db.execute(
+            pg_insert(models.IndicatorValue)
+            .on_conflict_do_nothing(constraint="uix_indicator_value")
+            .returning(
+                models.IndicatorValue.id,
+                models.IndicatorValue.enterprise_id,
+                models.IndicatorValue.indicator_id,
+                models.IndicatorValue.value_date,
+                models.IndicatorValue.value,
+                models.IndicatorValue.currency_code
+            ),
+            [indicator_values[index].dict() for index in candidates.values()]
+        ).all()
+        for new_id, *key in inserted:
+            index = candidates[_duplicate_key(*key)]
+            results[index] = {"index": index, "status": "created", "id": new_id}
+        for index in candidates.values():
+            if results[index] is None:
+                results[index] = {"index": index, "status": "duplicate", "detail": "Такое значение уже существует"}
+
+        if inserted:
+            refresh_rollups(
+                db,
+                min(row.value_date for row in inserted),
+                max(row.value_date for row in inserted),
+                {row.enterprise_id for row in inserted},
+                {row.indicator_id for row in inserted}
+            )
+        db.commit()
+
+    return {
+        "created": sum(1 for r in results if r["status"] == "created"),
+        "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "results": results
+    }
+
+
+def _duplicate_key(enterprise_id, indicator_id, value_date, value, currency_code):
+    # Numeric из БД приходит как Decimal, из запроса — как float: приводим к одному виду
+    return enterprise_id, indicator_id, value_date, Decimal(str(value)), currency_code
 
 
 @router.put("/indicator-values/{id}", response_model=schemas.IndicatorValueSchema, tags=["indicator_values"], summary="Update an indicator value")
-def update_indicator_value(id: int, indicator_value: schemas.IndicatorValueCreateSchema, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def update_indicator_value(id: int, indicator_value: schemas.IndicatorValueCreateSchema, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_indicator_value = db.query(models.IndicatorValue).filter(models.IndicatorValue.id == id).first()
     if not db_indicator_value:
         raise HTTPException(status_code=404, detail="Indicator value not found")
+    old_group = (db_indicator_value.value_date, db_indicator_value.enterprise_id, db_indicator_value.indicator_id)
     for key, value in indicator_value.dict().items():
         setattr(db_indicator_value, key, value)
-    db.commit()
+    try:
+        groups = {old_group, (indicator_value.value_date, indicator_value.enterprise_id, indicator_value.indicator_id)}
+        # Блокировки пар берутся по возрастанию (предприятие, показатель), как в rollups._lock_groups
+        # и массовой вставке: иначе встречное изменение тех же двух пар приводит к deadlock
+        for value_date, enterprise_id, indicator_id in sorted(groups, key=lambda group: (group[1], group[2], group[0])):
+            refresh_rollups(db, value_date, value_date, [enterprise_id], [indicator_id])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Такое значение уже существует")
     db.refresh(db_indicator_value)
     return db_indicator_value
 
 @router.delete("/indicator-values/{id}", tags=["indicator_values"], summary="Delete an indicator value")
-def delete_indicator_value(id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+def delete_indicator_value(id: int, db: Session = Depends(get_db), principal=Depends(get_current_principal)):
     db_indicator_value = db.query(models.IndicatorValue).filter(models.IndicatorValue.id == id).first()
     if not db_indicator_value:
         raise HTTPException(status_code=404, detail="Indicator value not found")
     db.delete(db_indicator_value)
+    refresh_rollups(db, db_indicator_value.value_date, db_indicator_value.value_date, [db_indicator_value.enterprise_id], [db_indicator_value.indicator_id])
     db.commit()
     return {"detail": "Indicator value deleted"}
 
@@ -470,260 +700,50 @@ def get_weighted_indicators(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    principal=Depends(get_current_principal)
 ):
-    query = db.query(models.IndicatorValue, models.Indicator.name, models.Indicator.importance).join(
-        models.Indicator, models.IndicatorValue.indicator_id == models.Indicator.id
-    ).filter(models.IndicatorValue.enterprise_id == enterprise_id)
-
-    if indicator_id:
-        query = query.filter(models.IndicatorValue.indicator_id == indicator_id)
-    if from_date:
-        query = query.filter(models.IndicatorValue.value_date >= from_date)
-    if to_date:
-        query = query.filter(models.IndicatorValue.value_date <= to_date)
-
-    if not group_by and not aggregate:
-        query = query.offset(skip).limit(limit)
-    indicator_values = query.all()
-
-    dates = {item[0].value_date for item in indicator_values}
-    currencies = {item[0].currency_code for item in indicator_values}
-
-    exchange_rates = db.query(models.ExchangeRate).filter(
-        models.ExchangeRate.from_currency.in_(currencies),
-        models.ExchangeRate.to_currency == target_currency,
-        models.ExchangeRate.rate_date.in_(dates)
-    ).all()
-
-    rate_dict: Dict[tuple, float] = {
-        (rate.from_currency, rate.rate_date): float(rate.rate) for rate in exchange_rates
-    }
+    filters = weighted_filters(enterprise_id, indicator_id, from_date, to_date)
 
+    # Взвешивание, конвертация и суммирование выполняются в БД одним запросом
     if group_by:
-        if group_by == "month":
-            period_expr = func.to_char(models.IndicatorValue.value_date, 'YYYY-MM')
-        elif group_by == "quarter":
-            period_expr = func.concat(
-                func.extract('year', models.IndicatorValue.value_date),
-                '-Q',
-                func.extract('quarter', models.IndicatorValue.value_date)
-            )
-
-        grouped_query = db.query(
-            period_expr.label('period'),
-            (models.IndicatorValue.value * models.Indicator.importance).label('weighted_value'),
-            models.IndicatorValue.currency_code,
-            models.IndicatorValue.value_date
-        ).join(
-            models.Indicator, models.IndicatorValue.indicator_id == models.Indicator.id
-        ).filter(
-            models.IndicatorValue.enterprise_id == enterprise_id
-        )
-
-        if indicator_id:
-            grouped_query = grouped_query.filter(models.IndicatorValue.indicator_id == indicator_id)
-        if from_date:
-            grouped_query = grouped_query.filter(models.IndicatorValue.value_date >= from_date)
-        if to_date:
-            grouped_query = grouped_query.filter(models.IndicatorValue.value_date <= to_date)
-
-        grouped_results = grouped_query.all()
-
-        grouped_dict = {}
-        for period, weighted_value, currency_code, value_date in grouped_results:
-            if period not in grouped_dict:
-                grouped_dict[period] = {"total_weighted_value": 0.0, "warning": None, "has_missing_rate": False}
-            
-            if currency_code == target_currency:
-                converted_value = float(weighted_value)
-            else:
-                rate_key = (currency_code, value_date)
-                if rate_key in rate_dict:
-                    converted_value = round(float(weighted_value) * rate_dict[rate_key], 2)
-                else:
-                    grouped_dict[period]["has_missing_rate"] = True
-                    converted_value = None
-
-            if converted_value is not None:
-                grouped_dict[period]["total_weighted_value"] += converted_value
-            else:
-                grouped_dict[period]["has_missing_rate"] = True
-
-        result = []
-        for period, data in grouped_dict.items():
-            result.append(schemas.WeightedIndicatorGroupSchema(
-                period=period,
-                total_weighted_value=round(data["total_weighted_value"], 2) if not data["has_missing_rate"] else None,
-                warning="No exchange rate found for some values" if data["has_missing_rate"] else None
-            ))
-        result.sort(key=lambda x: x.period)
-        return result
-
-    if aggregate:
-        total_weighted_value = 0.0
-        warning = None
-        for item, indicator_name, importance in indicator_values:
-            weighted_value = float(item.value) * float(importance)
-            if item.currency_code == target_currency:
-                converted_weighted_value = weighted_value
-            else:
-                rate_key = (item.currency_code, item.value_date)
-                if rate_key in rate_dict:
-                    converted_weighted_value = round(weighted_value * rate_dict[rate_key], 2)
-                else:
-                    warning = f"No exchange rate found for some values"
-                    converted_weighted_value = None
-            if converted_weighted_value is not None:
-                total_weighted_value += converted_weighted_value
-            else:
-                total_weighted_value = None
-                warning = f"No exchange rate found for some values"
-                break
-
-        return schemas.WeightedIndicatorAggregateSchema(
-            total_weighted_value=total_weighted_value,
-            warning=warning
-        )
-
-    result = []
-    for item, indicator_name, importance in indicator_values:
-        weighted_value = float(item.value) * float(importance)
-        item_dict = {
-            "indicator_id": item.indicator_id,
-            "indicator_name": indicator_name,
-            "value_date": item.value_date,
-            "original_value": float(item.value),
-            "currency_code": item.currency_code,
-            "importance": float(importance),
-            "weighted_value": weighted_value,
-            "converted_weighted_value": None,
-            "warning": None
-        }
-        if item.currency_code == target_currency:
-            item_dict["converted_weighted_value"] = round(weighted_value, 2)
+        # Если границы запроса совпадают с границами периодов, читаем готовую свёртку
+        if covers_range(from_date, to_date, group_by):
+            groups = grouped_totals(db, enterprise_id, group_by, target_currency, indicator_id, from_date, to_date)
         else:
-            rate_key = (item.currency_code, item.value_date)
-            if rate_key in rate_dict:
-                item_dict["converted_weighted_value"] = round(weighted_value * rate_dict[rate_key], 2)
-            else:
-                item_dict["converted_weighted_value"] = None
-                item_dict["warning"] = f"No exchange rate found for {item.currency_code} to {target_currency} on {item.value_date}"
-        result.append(item_dict)
-
-    return result
+            groups = db.execute(weighted_totals_stmt(filters, target_currency, group_by)).all()
+        return weighted_groups(groups)
 
-import requests
-import time
+    if aggregate:
+        total, missing = db.execute(weighted_totals_stmt(filters, target_currency)).one()
+        return weighted_aggregate(total, missing)
 
+    rows = db.execute(weighted_rows_stmt(filters, skip, limit)).all()
+    rate_table.ensure_loaded(db)
+    return weighted_rows(rows, target_currency)
 
 @router.post("/update-exchange-rates/", tags=["exchange_rates"], summary="Обновить курсы валют с внешнего API")
 def update_exchange_rates(
     target_date: date = Query(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    principal=Depends(get_current_principal)
 ):
     if target_date is None:
-        dates = db.query(models.IndicatorValue.value_date).distinct().all()
-        dates = [d[0] for d in dates if d[0] is not None]
+        # Планировщик одним запросом находит все даты с недостающими курсами
+        result = run_rate_backfill(db)
+        dates_count = result["dates"]
+        inserted, updated, failed_dates = result["inserted"], result["updated"], result["failed_dates"]
     else:
-        dates = [target_date]
-
-    currencies = ["USD", "EUR", "RUB"]
-    updated = 0
-    inserted = 0
-    failed_dates = []
-
-    for date in dates:
-        existing_rates = db.query(models.ExchangeRate).filter_by(rate_date=date).all()
-        if existing_rates:
-            existing_pairs = {(r.from_currency, r.to_currency) for r in existing_rates}
-            required_pairs = {("RUB", "USD"), ("RUB", "EUR"), ("USD", "RUB"), ("EUR", "RUB"), ("USD", "EUR"), ("EUR", "USD")}
-            if existing_pairs.issuperset(required_pairs):
-                print(f"[Update Exchange Rates] Курсы для {date} уже существуют, пропускаем")
-                continue
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                url = f"https://api.exchangerate.host/{date.isoformat()}?base=RUB&symbols=USD,EUR"
-                response = requests.get(url, timeout=5)
-                if response.ok:
-                    break
-                else:
-                    print(f"[Update Exchange Rates] Не удалось загрузить курсы для {date}, попытка {attempt + 1}/{max_retries}")
-                    time.sleep(1)
-            except requests.RequestException as e:
-                print(f"[Update Exchange Rates] Ошибка запроса для {date}: {str(e)}, попытка {attempt + 1}/{max_retries}")
-                time.sleep(1)
-        else:
-            print(f"[Update Exchange Rates] ❌ Не удалось загрузить курсы для {date} после {max_retries} попыток")
-            failed_dates.append(date)
-            continue
-
-        data = response.json()
-        rates = data.get("rates", {})
-
-        for to_currency, rate in rates.items():
-            for from_currency, actual_rate in [
-                ("RUB", rate),
-                (to_currency, round(1 / rate, 6))
-            ]:
-                target_currency = to_currency if from_currency == "RUB" else "RUB"
-
-                db_rate = db.query(models.ExchangeRate).filter_by(
-                    from_currency=from_currency,
-                    to_currency=target_currency,
-                    rate_date=date
-                ).first()
-
-                if db_rate:
-                    if abs(db_rate.rate - actual_rate) > 0.0001:
-                        db_rate.rate = actual_rate
-                        db.commit()
-                        updated += 1
-                else:
-                    new_rate = models.ExchangeRate(
-                        from_currency=from_currency,
-                        to_currency=target_currency,
-                        rate=actual_rate,
-                        rate_date=date
-                    )
-                    db.add(new_rate)
-                    db.commit()
-                    inserted += 1
-
-        if "USD" in rates and "EUR" in rates:
-            usd_to_eur = round(rates["EUR"] / rates["USD"], 6)
-            eur_to_usd = round(rates["USD"] / rates["EUR"], 6)
-
-            for pair in [("USD", "EUR", usd_to_eur), ("EUR", "USD", eur_to_usd)]:
-                from_c, to_c, rate_val = pair
-                db_rate = db.query(models.ExchangeRate).filter_by(
-                    from_currency=from_c,
-                    to_currency=to_c,
-                    rate_date=date
-                ).first()
-
-                if db_rate:
-                    if abs(db_rate.rate - rate_val) > 0.0001:
-                        db_rate.rate = rate_val
-                        db.commit()
-                        updated += 1
-                else:
-                    new_rate = models.ExchangeRate(
-                        from_currency=from_c,
-                        to_currency=to_c,
-                        rate=rate_val,
-                        rate_date=date
-                    )
-                    db.add(new_rate)
-                    db.commit()
-                    inserted += 1
+        plan = plan_for_date(db, target_date)
+        if not plan:
+            print(f"[Update Exchange Rates] Курсы для {target_date} уже существуют, пропускаем")
+        dates_count = 1
+        inserted, updated, failed_dates, written = sync_rate_dates(db, plan)
+        db.commit()
+        rate_table.set_many(written)
 
     if failed_dates:
         print(f"[Update Exchange Rates] Не удалось загрузить курсы для дат: {failed_dates}")
     return {
-        "detail": f"Добавлено новых: {inserted}, обновлено: {updated} для {len(dates)} дат",
+        "detail": f"Добавлено новых: {inserted}, обновлено: {updated} для {dates_count} дат",
         "failed_dates": failed_dates
     }
\ No newline at end of file
@@ -105,6 +105,24 @@ class IndicatorValueCreateSchema(BaseModel):
     class Config:
         extra = "forbid"
 
+class IndicatorValueBulkItemResultSchema(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+    class Config:
+        extra = "forbid"
+
+class IndicatorValueBulkResultSchema(BaseModel):
+    created: int
+    duplicates: int
+    errors: int
+    results: List[IndicatorValueBulkItemResultSchema]
+
+    class Config:
+        extra = "forbid"
+
 class WeightedIndicatorSchema(BaseModel):
     indicator_id: int
     indicator_name: str
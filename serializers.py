@@ -0,0 +1,154 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import HTTPException
+
+import models
+import schemas
+from rate_cache import convert_value, rate_table
+
+# Поля ответа /indicator-values/ для каждого shape в порядке вывода
+INDICATOR_VALUE_FIELDS = {
+    "nested": ("id", "value", "value_date", "indicator", "enterprise", "currency_code", "converted_value", "warning"),
+    "flat": ("id", "value", "value_date", "indicator_id", "enterprise_id", "currency_code", "converted_value", "warning"),
+}
+
+
+def serialize_indicator_values(items: Iterable[models.IndicatorValue], target_currency: str) -> bytes:
+    """JSON-ответ /indicator-values/ в формате IndicatorValueWithObjects.
+
+    Каждое предприятие и показатель проходят валидацию схемой один раз и затем
+    переиспользуются во всех строках; строки собираются как словари и кодируются orjson.
+    """
+    enterprises = {}
+    indicators = {}
+    rows = []
+    for item in items:
+        if not item.enterprise or not item.indicator:
+            continue
+
+        enterprise = enterprises.get(item.enterprise_id)
+        if enterprise is None:
+            enterprise = enterprises[item.enterprise_id] = schemas.EnterpriseSchema.from_orm(item.enterprise).dict()
+        indicator = indicators.get(item.indicator_id)
+        if indicator is None:
+            indicator = indicators[item.indicator_id] = schemas.IndicatorSchema.from_orm(item.indicator).dict()
+
+        converted_value, warning = convert_value(item.value, item.currency_code, item.value_date, target_currency)
+        rows.append({
+            "id": item.id,
+            "value": float(item.value),
+            "value_date": item.value_date,
+            "indicator": indicator,
+            "enterprise": enterprise,
+            "currency_code": item.currency_code,
+            "converted_value": converted_value,
+            "warning": warning,
+        })
+    return orjson.dumps(rows)
+
+
+def parse_fields(fields: Optional[str], shape: str) -> Tuple[str, ...]:
+    """Разбирает параметр fields=a,b,c; порядок полей всегда как в INDICATOR_VALUE_FIELDS."""
+    allowed = INDICATOR_VALUE_FIELDS[shape]
+    if not fields:
+        return allowed
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(allowed)
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields for shape={shape}: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}"
+        )
+    return tuple(name for name in allowed if name in requested)
+
+
+def serialize_indicator_value_rows(
+    rows: Iterable,
+    fields: Sequence[str],
+    target_currency: str,
+    enterprises: Optional[Dict[int, dict]] = None,
+    indicators: Optional[Dict[int, dict]] = None,
+) -> bytes:
+    """JSON-ответ из строк Core select() только с запрошенными полями.
+
+    Для вложенных enterprise/indicator передаются заранее собранные словари по id;
+    строки, для которых объект не найден, пропускаются, как и в serialize_indicator_values.
+    """
+    convert = "converted_value" in fields or "warning" in fields
+    result = []
+    for row in rows:
+        item = {}
+        if convert:
+            converted_value, warning = convert_value(row.value, row.currency_code, row.value_date, target_currency)
+        for field in fields:
+            if field == "value":
+                item[field] = float(row.value)
+            elif field == "converted_value":
+                item[field] = converted_value
+            elif field == "warning":
+                item[field] = warning
+            elif field == "enterprise":
+                item[field] = enterprises.get(row.enterprise_id)
+                if item[field] is None:
+                    break
+            elif field == "indicator":
+                item[field] = indicators.get(row.indicator_id)
+                if item[field] is None:
+                    break
+            else:
+                item[field] = getattr(row, field)
+        else:
+            result.append(item)
+    return orjson.dumps(result)
+
+
+def objects_by_id(rows: Iterable, schema) -> Dict[int, dict]:
+    """Строки enterprises_stmt()/indicators_stmt() → {id: словарь схемы}."""
+    return {row.id: schema.from_orm(row).dict() for row in rows}
+
+
+def weighted_groups(groups) -> List[schemas.WeightedIndicatorGroupSchema]:
+    return [
+        schemas.WeightedIndicatorGroupSchema(
+            period=period,
+            total_weighted_value=round(float(total), 2) if not missing else None,
+            warning="No exchange rate found for some values" if missing else None
+        )
+        for period, total, missing in groups
+    ]
+
+
+def weighted_aggregate(total, missing) -> schemas.WeightedIndicatorAggregateSchema:
+    return schemas.WeightedIndicatorAggregateSchema(
+        total_weighted_value=float(total or 0.0) if not missing else None,
+        warning="No exchange rate found for some values" if missing else None
+    )
+
+
+def weighted_rows(rows: Iterable, target_currency: str) -> List[dict]:
+    """Строки weighted_rows_stmt() со взвешенным и сконвертированным значением."""
+    result = []
+    for indicator_id, indicator_name, value_date, value, currency_code, importance in rows:
+        weighted_value = float(value) * float(importance)
+        item_dict = {
+            "indicator_id": indicator_id,
+            "indicator_name": indicator_name,
+            "value_date": value_date,
+            "original_value": float(value),
+            "currency_code": currency_code,
+            "importance": float(importance),
+            "weighted_value": weighted_value,
+            "converted_weighted_value": None,
+            "warning": None
+        }
+        if currency_code == target_currency:
+            item_dict["converted_weighted_value"] = round(weighted_value, 2)
+        else:
+            rate = rate_table.get(currency_code, target_currency, value_date)
+            if rate is not None:
+                item_dict["converted_weighted_value"] = round(weighted_value * rate, 2)
+            else:
+                item_dict["warning"] = f"No exchange rate found for {currency_code} to {target_currency} on {value_date}"
+        result.append(item_dict)
+    return result
@@ -0,0 +1,64 @@
+"""Общая база для тестов: тот же набор данных и TestClient, что и в benchmarks/run.py.
+
+По умолчанию — временный SQLite; TEST_DATABASE_URL=postgresql://... прогоняет
+и тесты, помеченные requires_postgres (upsert, date_trunc).
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+# models читает DATABASE_URL при импорте, поэтому адрес задаётся до любых импортов приложения
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["EXCHANGE_API_RPS"] = "0"
+
+import seed  # noqa: E402
+
+POSTGRES = TEST_DATABASE_URL.startswith("postgresql")
+requires_postgres = pytest.mark.skipif(not POSTGRES, reason="нужен PostgreSQL: TEST_DATABASE_URL=postgresql://...")
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    args = seed.parse_args([
+        "--database-url", TEST_DATABASE_URL, "--enterprises", "3", "--indicators", "4", "--days", "90", "--reset"
+    ])
+    seed.seed(args)
+    return args
+
+
+@pytest.fixture(scope="session")
+def client(dataset):
+    from fastapi.testclient import TestClient
+
+    import main
+    import models
+    from hashing import hashing_pool
+    from rate_cache import rate_table
+
+    # Таблица курсов загружается раз в RATE_CACHE_TTL; в бюджеты маршрутов эта загрузка не входит
+    db = models.SessionLocal()
+    try:
+        rate_table.reload(db)
+    finally:
+        db.close()
+
+    # Без контекстного менеджера lifespan не запускается: ни планировщика, ни синхронизации курсов
+    test_client = TestClient(main.app)
+    yield test_client
+    hashing_pool.shutdown()
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    response = client.post("/token", data={"username": seed.BENCH_USERNAME, "password": seed.BENCH_PASSWORD})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
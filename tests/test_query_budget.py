@@ -0,0 +1,84 @@
+"""Число SQL-запросов на горячих маршрутах не должно расти незаметно.
+
+Бюджеты — текущее число запросов: если изменение добавляет запрос (например, N+1
+при загрузке связанных объектов), тест падает и печатает выполненные SQL.
+"""
+from datetime import timedelta
+
+import pytest
+
+from conftest import requires_postgres
+from query_budget import query_budget
+from rollups import period_end
+
+
+def test_indicator_values_nested(client, auth_headers):
+    with query_budget(3):
+        response = client.get("/indicator-values/", params={"enterprise_id": 1, "limit": 100}, headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 100
+
+
+def test_indicator_values_flat(client, auth_headers):
+    params = {"enterprise_id": 1, "limit": 100, "shape": "flat", "fields": "value_date,value,converted_value"}
+    with query_budget(1):
+        response = client.get("/indicator-values/", params=params, headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_weighted_indicators_plain(client, auth_headers):
+    with query_budget(1):
+        response = client.get("/weighted-indicators/", params={"enterprise_id": 1, "limit": 100}, headers=auth_headers)
+    assert response.status_code == 200
+
+
+@requires_postgres
+def test_weighted_indicators_grouped(client, auth_headers, dataset):
+    # Целые месяцы — ответ строится по свёртке indicator_rollups, которую seed заполняет
+    # только на PostgreSQL; суммы должны совпасть с агрегацией по самим значениям
+    import models
+    from queries import weighted_filters, weighted_totals_stmt
+
+    to_date = period_end(dataset.start + timedelta(days=31), "month")
+    params = {"enterprise_id": 1, "group_by": "month", "from_date": dataset.start.isoformat(), "to_date": to_date.isoformat()}
+    with query_budget(1):
+        response = client.get("/weighted-indicators/", params=params, headers=auth_headers)
+    assert response.status_code == 200
+
+    db = models.SessionLocal()
+    try:
+        stmt = weighted_totals_stmt(weighted_filters(1, None, dataset.start, to_date), "RUB", "month")
+        expected = {period: (total, missing) for period, total, missing in db.execute(stmt)}
+    finally:
+        db.close()
+    groups = response.json()
+    assert len(expected) == 2
+    assert [group["period"] for group in groups] == sorted(expected)
+    for group in groups:
+        total, missing = expected[group["period"]]
+        if missing:
+            assert group["total_weighted_value"] is None
+        else:
+            assert group["total_weighted_value"] == pytest.approx(float(total), abs=0.01)
+
+
+def test_enterprises(client, auth_headers, dataset):
+    # Версия справочника для ETag и сам список
+    with query_budget(2):
+        response = client.get("/enterprises/", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()) == dataset.enterprises
+
+
+@requires_postgres
+def test_indicator_values_bulk(client, auth_headers, dataset):
+    day = dataset.start + timedelta(days=dataset.days + 30)
+    payload = [
+        {"enterprise_id": 1, "indicator_id": indicator_id, "value_date": day.isoformat(), "value": 100 + indicator_id, "currency_code": "USD"}
+        for indicator_id in range(1, 5)
+    ]
+    # Три проверки ссылок, одна вставка пакетом, две advisory-блокировки свёртки,
+    # удаление и вставка свёртки на месяц и квартал
+    with query_budget(10):
+        response = client.post("/indicator-values/bulk", json=payload, headers=auth_headers)
+    assert response.status_code == 200, response.text